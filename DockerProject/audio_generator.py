@@ -7,6 +7,16 @@ import tempfile
 import sys
 import shutil
 import re
+import time
+import multiprocessing
+import queue
+import threading
+import collections
+from importlib import metadata
+
+import tts_backends
+import tts_cache
+import tts_worker
 
 # Import Kokoro TTS
 try:
@@ -21,10 +31,44 @@ except ImportError as e:
 # Paths
 SCRIPT_FILE = "/app/temp/current_script.txt"
 AUDIO_DIR = "/app/temp/my_audio"
-TEMP_AUDIO_DIR = "/app/temp/audio_segments"  # Thư mục tạm cho segments
 
 # Config
-MAX_CHARS_PER_SEGMENT = 400  # Giới hạn ký tự cho mỗi segment
+VOICE = "af_heart"
+LANG_CODE = "a"
+SAMPLE_RATE = 24000
+AUDIO_DTYPE = np.float32  # Kiểu dữ liệu audio trong bộ nhớ (Kokoro trả về float32)
+AUDIO_FORMAT = os.getenv("AUDIO_FORMAT", "wav")  # wav | flac cho file my_audio/output_{i}
+AUDIO_SUBTYPE = os.getenv("AUDIO_SUBTYPE", "PCM_16")  # PCM_16 | PCM_24 | FLOAT (FLOAT chỉ dùng được với wav)
+SEGMENT_SILENCE_SECONDS = 0.1  # Khoảng lặng giữa các segment
+MAX_TOKENS_PER_SEGMENT = 510  # Giới hạn phoneme tokens của Kokoro cho 1 lần inference
+MAX_CHARS_PER_SEGMENT = 2000  # Giới hạn ký tự khi không có tokenizer (demo fallback)
+TTS_MODE = os.getenv("TTS_MODE", "serial")  # serial | batch | parallel | pipelined
+TTS_BACKEND = os.getenv("TTS_BACKEND", "torch")  # torch | torch-int8 | onnx (xem tts_backends.py)
+TTS_BATCH_SIZE = int(os.getenv("TTS_BATCH_SIZE", "8"))  # Số segment mỗi lần gọi model (batch mode)
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "0"))  # Số process (parallel mode), 0 = tự tính theo CPU quota
+TTS_G2P_QUEUE_SIZE = int(os.getenv("TTS_G2P_QUEUE_SIZE", "8"))  # Số segment G2P được chạy trước (pipelined mode)
+
+def get_model_version():
+    """Installed Kokoro version, part of the TTS cache key"""
+    try:
+        return f"kokoro-{metadata.version('kokoro')}"
+    except metadata.PackageNotFoundError:
+        return "kokoro-unknown"
+
+MODEL_VERSION = get_model_version()
+
+def get_output_subtype():
+    """soundfile subtype for line audio files, adjusted to what AUDIO_FORMAT supports"""
+    if AUDIO_FORMAT == "flac" and AUDIO_SUBTYPE == "FLOAT":
+        # FLAC chỉ lưu PCM số nguyên, 24-bit là gần float32 nhất
+        print("⚠️ FLAC cannot store float samples, using PCM_24")
+        return "PCM_24"
+    return AUDIO_SUBTYPE
+
+# Parallel mode state
+_parallel_pool = None
+_parallel_workers = 0
+_worker_pipeline = None
 
 def setup_directories():
     """Setup and clean directories"""
@@ -33,118 +77,100 @@ def setup_directories():
         shutil.rmtree(AUDIO_DIR)
     os.makedirs(AUDIO_DIR, exist_ok=True)
     
-    # Clean temp audio segments directory
-    if os.path.exists(TEMP_AUDIO_DIR):
-        shutil.rmtree(TEMP_AUDIO_DIR)
-    os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
-    
     print(f"✅ Audio directory setup: {AUDIO_DIR}")
-    print(f"✅ Temp segments directory setup: {TEMP_AUDIO_DIR}")
 
-def split_text_into_segments(text, max_chars=MAX_CHARS_PER_SEGMENT):
-    """Chia text thành các segments dựa trên câu và giới hạn ký tự"""
-    if len(text) <= max_chars:
-        return [text]
+def _pack_pieces(pieces, sizes, limit):
+    """Greedy packing: gom các piece liền nhau cho đến khi chạm giới hạn, trả về list các nhóm"""
+    groups = []
+    current = []
+    current_size = 0
+    for piece, size in zip(pieces, sizes):
+        if current and current_size + 1 + size > limit:
+            groups.append(current)
+            current = []
+            current_size = 0
+        current_size += size + (1 if current else 0)
+        current.append(piece)
+    if current:
+        groups.append(current)
+    return groups
+
+def split_text_into_segments(text, pipeline=None, max_units=None):
+    """Chia text thành segments (text, phonemes) theo câu, đo bằng phoneme tokens của Kokoro.
     
+    Every sentence goes through G2P once; sentences are packed greedily up to
+    the model's token limit using those phoneme counts, and each segment keeps
+    its phoneme string so inference does not run G2P again. A sentence too
+    long for one call comes back from the tokenizer already cut into chunks.
+    Without a pipeline (or if G2P fails) the length is measured in characters
+    and phonemes is None.
+    """
+    text = text.strip()
+    if not text:
+        return []
     # Chia theo câu trước
-    sentences = re.split(r'(?<=[.!?])\s+', text)
+    sentences = [s for s in re.split(r'(?<=[.!?])\s+', text) if s]
     
-    segments = []
-    current_segment = ""
+    if KOKORO_AVAILABLE and pipeline:
+        try:
+            chunks = [chunk for sentence in sentences for chunk in pipeline.phonemize(sentence)]
+            groups = _pack_pieces(chunks, [len(phonemes) for _, phonemes in chunks], max_units or MAX_TOKENS_PER_SEGMENT)
+            return [(" ".join(graphemes for graphemes, _ in group), " ".join(phonemes for _, phonemes in group))
+                    for group in groups]
+        except Exception as e:
+            print(f"⚠️ G2P failed, splitting by characters: {e}")
     
+    return [(segment, None) for segment in split_by_chars(sentences, max_units or MAX_CHARS_PER_SEGMENT)]
+
+def split_by_chars(sentences, max_chars):
+    """Pack sentences up to max_chars; a sentence too long on its own is split at clauses, then at words"""
+    pieces = []
     for sentence in sentences:
-        # Nếu câu đơn lẻ đã vượt quá giới hạn
-        if len(sentence) > max_chars:
-            # Lưu segment hiện tại nếu có
-            if current_segment:
-                segments.append(current_segment.strip())
-                current_segment = ""
-            
-            # Chia câu dài theo từ
-            words = sentence.split()
-            temp_sentence = ""
-            for word in words:
-                if len(temp_sentence + " " + word) <= max_chars:
-                    temp_sentence += (" " + word) if temp_sentence else word
-                else:
-                    if temp_sentence:
-                        segments.append(temp_sentence.strip())
-                    temp_sentence = word
-            
-            if temp_sentence:
-                segments.append(temp_sentence.strip())
-        else:
-            # Kiểm tra nếu thêm câu này có vượt quá giới hạn không
-            if len(current_segment + " " + sentence) <= max_chars:
-                current_segment += (" " + sentence) if current_segment else sentence
-            else:
-                # Lưu segment hiện tại và bắt đầu segment mới
-                if current_segment:
-                    segments.append(current_segment.strip())
-                current_segment = sentence
-    
-    # Lưu segment cuối cùng
-    if current_segment:
-        segments.append(current_segment.strip())
-    
-    return segments
-
-def text_to_speech_kokoro(text, output_file, pipeline=None):
-    """Use Kokoro TTS for high-quality audio generation"""
-    try:
-        if not KOKORO_AVAILABLE or pipeline is None:
-            return False
-            
-        print(f"🎵 Creating speech with Kokoro TTS ({len(text)} chars)...")
-        
-        # Generate speech with high quality voice - sử dụng pipeline được truyền vào
-        audio_result = pipeline(text, voice="af_heart")
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
         
-        # Process audio result
-        if hasattr(audio_result, '__iter__') and not isinstance(audio_result, (list, np.ndarray)):
-            audio_list = list(audio_result)
-            if audio_list:
-                audio_item = audio_list[0]
-                
-                # Extract audio from Result object
-                if hasattr(audio_item, 'output'):
-                    if hasattr(audio_item.output, 'audio'):
-                        audio = audio_item.output.audio
-                    else:
-                        audio = audio_item.output
-                else:
-                    audio = audio_item
-                    
-                # Convert tensor to numpy
-                if torch.is_tensor(audio):
-                    audio = audio.detach().cpu().numpy()
-                
-                # Flatten if needed
-                if audio.ndim > 1:
-                    audio = audio.flatten()
-                    
-                # Save file with 24kHz sample rate
-                sf.write(output_file, audio, 24000)
-                
-                duration = len(audio) / 24000
-                print(f"✅ Created Kokoro audio: {duration:.2f}s - {output_file}")
-                return True
-            else:
-                print("❌ Empty audio list")
-                return False
-        else:
-            print("❌ Audio result format incorrect")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Kokoro TTS error: {e}")
-        return False
+        # Câu quá dài: chia theo mệnh đề, rồi theo từ nếu vẫn quá dài
+        for clause in (c for c in re.split(r'(?<=[,;:])\s+', sentence) if c):
+            if len(clause) <= max_chars:
+                pieces.append(clause)
+                continue
+            words = clause.split()
+            pieces.extend(" ".join(group) for group in _pack_pieces(words, [len(word) for word in words], max_chars))
+    
+    return [" ".join(group) for group in _pack_pieces(pieces, [len(piece) for piece in pieces], max_chars)]
 
-def create_demo_audio(text, output_file, duration_seconds=8):
-    """Create demo audio if TTS fails"""
+def text_to_speech_kokoro(text, pipeline=None, phonemes=None):
+    """Use Kokoro TTS for high-quality audio generation, yield audio chunks as they are produced.
+    
+    With phonemes (from split_text_into_segments) only the acoustic model
+    runs; otherwise the configured backend (TTS_BACKEND) does G2P and yields
+    every chunk in order instead of materializing the whole generator.
+    """
+    if not KOKORO_AVAILABLE or pipeline is None:
+        return
+    
+    print(f"🎵 Creating speech with Kokoro TTS ({len(text)} chars)...")
+    
+    # Generate speech with high quality voice - sử dụng pipeline được truyền vào
+    chunks = [pipeline.infer(phonemes)] if phonemes else pipeline.synthesize(text)
+    for audio in chunks:
+        if len(audio):
+            yield audio.astype(AUDIO_DTYPE, copy=False)
+
+def join_with_silence(segment_audios):
+    """Yield segment audio with a short silence between segments"""
+    silence = np.zeros(int(SEGMENT_SILENCE_SECONDS * SAMPLE_RATE), dtype=AUDIO_DTYPE)
+    for seg_idx, audio in enumerate(segment_audios):
+        if seg_idx:
+            yield silence
+        yield audio
+
+def create_demo_audio(text, duration_seconds=8):
+    """Create demo audio if TTS fails, return audio array or None"""
     try:
-        sample_rate = 24000
-        t = np.linspace(0, duration_seconds, int(sample_rate * duration_seconds))
+        sample_rate = SAMPLE_RATE
+        t = np.linspace(0, duration_seconds, int(sample_rate * duration_seconds), dtype=AUDIO_DTYPE)
         
         word_count = len(text.split())
         base_freq = 440
@@ -164,126 +190,126 @@ def create_demo_audio(text, output_file, duration_seconds=8):
         
         # Apply fade in/out
         fade_samples = int(0.1 * sample_rate)
-        audio[:fade_samples] *= np.linspace(0, 1, fade_samples)
-        audio[-fade_samples:] *= np.linspace(1, 0, fade_samples)
+        audio[:fade_samples] *= np.linspace(0, 1, fade_samples, dtype=AUDIO_DTYPE)
+        audio[-fade_samples:] *= np.linspace(1, 0, fade_samples, dtype=AUDIO_DTYPE)
         
-        sf.write(output_file, audio, sample_rate)
-        print(f"✅ Created demo audio: {duration_seconds}s - {output_file}")
-        return True
+        print(f"✅ Created demo audio: {duration_seconds}s")
+        return audio
         
     except Exception as e:
         print(f"❌ Demo audio error: {e}")
-        return False
+        return None
 
-def concatenate_audio_files(audio_files, output_file):
-    """Ghép nhiều file audio thành 1 file"""
-    try:
-        if not audio_files:
-            return False
-        
-        if len(audio_files) == 1:
-            # Chỉ có 1 file, copy trực tiếp
-            shutil.copy(audio_files[0], output_file)
-            print(f"✅ Single audio copied: {output_file}")
-            return True
-        
-        # Ghép nhiều file
-        combined_audio = []
-        sample_rate = 24000
-        
-        for audio_file in audio_files:
-            try:
-                audio_data, sr = sf.read(audio_file)
-                if sr != sample_rate:
-                    print(f"⚠️ Sample rate mismatch: {sr} != {sample_rate}")
-                
-                # Thêm khoảng lặng ngắn giữa các segment (0.1s)
-                if combined_audio:
-                    silence = np.zeros(int(0.1 * sample_rate))
-                    combined_audio.extend(silence)
-                
-                combined_audio.extend(audio_data)
-            except Exception as e:
-                print(f"⚠️ Error reading {audio_file}: {e}")
-                continue
-        
-        if combined_audio:
-            sf.write(output_file, np.array(combined_audio), sample_rate)
-            duration = len(combined_audio) / sample_rate
-            print(f"✅ Concatenated audio: {duration:.2f}s - {output_file}")
-            return True
-        else:
-            print("❌ No valid audio data to concatenate")
-            return False
-            
-    except Exception as e:
-        print(f"❌ Concatenation error: {e}")
-        return False
+def iter_segment_audio(segment, pipeline):
+    """Yield audio chunks for one (text, phonemes) segment: cache → Kokoro (chunk by chunk) → demo fallback.
+    
+    The fallback is only used when Kokoro produced nothing. An error after
+    some chunks were yielded is re-raised: the line would otherwise lose the
+    end of its narration and still count as a success.
+    """
+    text, phonemes = segment
+    # Cache trước, chỉ synth các segment chưa có
+    key = segment_cache_key(text)
+    audio = tts_cache.load_cached_audio(key)
+    if audio is not None:
+        print(f"   💾 Cache hit ({len(audio) / SAMPLE_RATE:.2f}s)")
+        yield audio
+        return
+    
+    # Thử Kokoro TTS, ghi vào cache song song với output
+    produced = 0
+    if KOKORO_AVAILABLE and pipeline:
+        writer = tts_cache.CacheWriter(key)
+        try:
+            for chunk in text_to_speech_kokoro(text, pipeline, phonemes):
+                writer.write(chunk)
+                produced += len(chunk)
+                yield chunk
+            if produced:
+                writer.commit()
+        except Exception as e:
+            print(f"❌ Kokoro TTS error: {e}")
+            if produced:
+                raise
+        finally:
+            writer.discard()
+    
+    if produced:
+        print(f"✅ Created Kokoro audio: {produced / SAMPLE_RATE:.2f}s")
+        return
+    
+    # Fallback: Demo audio
+    audio = create_fallback_audio(text)
+    if audio is not None:
+        yield audio
 
-def process_line_audio(line_text, line_index, pipeline):
-    """Xử lý 1 dòng: chia segments → tạo audio → ghép lại"""
-    print(f"\n🔊 Processing line {line_index+1} ({len(line_text)} chars)...")
+def iter_line_audio(line_text, pipeline):
+    """Yield audio của 1 dòng theo từng chunk, có khoảng lặng giữa các segment.
     
-    # Chia text thành segments
-    segments = split_text_into_segments(line_text, MAX_CHARS_PER_SEGMENT)
+    Only the chunk being produced is held in memory; the file path writes it
+    to output_{i}.wav and the streaming path pipes it to ffmpeg.
+    """
+    segments = split_text_into_segments(line_text, pipeline)
     print(f"📝 Split into {len(segments)} segments")
+    silence = np.zeros(int(SEGMENT_SILENCE_SECONDS * SAMPLE_RATE), dtype=AUDIO_DTYPE)
     
-    # Tạo audio cho từng segment
-    segment_audio_files = []
-    success_count = 0
-    
+    produced_segments = 0
     for seg_idx, segment in enumerate(segments):
-        segment_file = os.path.join(TEMP_AUDIO_DIR, f"line_{line_index}_seg_{seg_idx}.wav")
-        print(f"   🎵 Segment {seg_idx+1}/{len(segments)} ({len(segment)} chars)...")
-        
-        success = False
-        
-        # Thử Kokoro TTS trước
-        if KOKORO_AVAILABLE and pipeline:
-            success = text_to_speech_kokoro(segment, segment_file, pipeline)
-        
-        # Fallback: Demo audio
-        if not success:
-            print("   [FALLBACK] Using demo audio...")
-            words_per_minute = 150
-            duration = max(3, len(segment.split()) / words_per_minute * 60)
-            success = create_demo_audio(segment, segment_file, duration)
-        
-        if success:
-            segment_audio_files.append(segment_file)
-            success_count += 1
-        else:
+        print(f"   🎵 Segment {seg_idx+1}/{len(segments)} ({len(segment[0])} chars)...")
+        first_chunk = True
+        for chunk in iter_segment_audio(segment, pipeline):
+            if first_chunk and produced_segments:
+                yield silence
+            first_chunk = False
+            yield chunk
+        if first_chunk:
             print(f"   ❌ Failed to create audio for segment {seg_idx+1}")
+        else:
+            produced_segments += 1
     
-    print(f"📊 Created {success_count}/{len(segments)} audio segments")
-    
-    # Ghép tất cả segments thành 1 audio cho dòng này
-    final_audio_file = os.path.join(AUDIO_DIR, f"output_{line_index}.wav")
+    print(f"📊 Created {produced_segments}/{len(segments)} audio segments")
+
+def process_line_audio(line_text, line_index, pipeline, output_dir=None):
+    """Xử lý 1 dòng: chia segments → tạo audio → ghi thẳng ra file"""
+    print(f"\n🔊 Processing line {line_index+1} ({len(line_text)} chars)...")
+    return write_line_audio(iter_line_audio(line_text, pipeline), line_index, output_dir)
+
+def segment_cache_key(segment):
+    """TTS cache key for one segment with the current voice/model settings"""
+    # Backend là một phần của model: int8/ONNX cho ra audio khác fp32
+    return tts_cache.cache_key(segment, VOICE, LANG_CODE, SAMPLE_RATE, f"{MODEL_VERSION}/{TTS_BACKEND}")
+
+def create_fallback_audio(segment):
+    """Demo audio sized to the segment's speaking time"""
+    print("   [FALLBACK] Using demo audio...")
+    words_per_minute = 150
+    duration = max(3, len(segment.split()) / words_per_minute * 60)
+    return create_demo_audio(segment, duration)
+
+def write_line_audio(audio_chunks, line_index, output_dir=None):
+    """Ghi output_{i}.wav (hoặc .flac) từng chunk một khi audio được tạo ra"""
+    final_audio_file = os.path.join(output_dir or AUDIO_DIR, f"output_{line_index}.{AUDIO_FORMAT}")
+    total_samples = 0
+    try:
+        with sf.SoundFile(final_audio_file, "w", samplerate=SAMPLE_RATE, channels=1,
+                          format=AUDIO_FORMAT.upper(), subtype=get_output_subtype()) as output:
+            for chunk in audio_chunks:
+                output.write(chunk)
+                total_samples += len(chunk)
+    except Exception as e:
+        print(f"❌ Failed to write audio for line {line_index+1}: {e}")
+        total_samples = 0
     
-    if segment_audio_files:
-        concatenate_success = concatenate_audio_files(segment_audio_files, final_audio_file)
-        
-        # Clean up temp files
-        for temp_file in segment_audio_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
-        
-        if concatenate_success:
-            # Verify final audio
-            try:
-                audio_data, sr = sf.read(final_audio_file)
-                duration = len(audio_data) / sr
-                print(f"✅ Final audio for line {line_index+1}: {duration:.2f}s")
-                return True
-            except Exception as e:
-                print(f"⚠️ Cannot verify final audio: {e}")
-                return False
-        else:
-            print(f"❌ Failed to concatenate audio for line {line_index+1}")
-            return False
-    else:
+    if total_samples == 0:
         print(f"❌ No valid audio segments for line {line_index+1}")
+        if os.path.exists(final_audio_file):
+            os.remove(final_audio_file)
         return False
+    
+    # Duration từ số sample, không cần đọc lại file
+    duration = total_samples / SAMPLE_RATE
+    print(f"✅ Final audio for line {line_index+1}: {duration:.2f}s - {final_audio_file}")
+    return True
 
 def chunk_text(text, max_length=100):
     """Split text into smaller chunks"""
@@ -306,6 +332,368 @@ def chunk_text(text, max_length=100):
         
     return chunks
 
+def load_pipeline(num_threads=None):
+    """Initialize the TTS backend once (None if Kokoro is unavailable)"""
+    if not KOKORO_AVAILABLE:
+        return None
+    try:
+        pipeline = tts_backends.load_backend(TTS_BACKEND, LANG_CODE, VOICE, num_threads)
+        print(f"✅ Kokoro TTS pipeline ready! (backend: {TTS_BACKEND})")
+        return pipeline
+    except Exception as e:
+        print(f"⚠️ Cannot create Kokoro pipeline: {e}")
+        return None
+
+def generate_audio_batched(lines, pipeline, batch_size=TTS_BATCH_SIZE, output_dir=None, cancelled=None):
+    """Batch mode: gom segments của nhiều dòng, nhóm theo độ dài, synth theo batch.
+    
+    Segments are sorted by phoneme count so each batch pads little, and
+    every batch is one backend.infer_batch() call. Segments without
+    phonemes (no pipeline, G2P failed) and failed batches go through
+    iter_segment_audio one by one.
+    """
+    # (line_idx, seg_idx, segment) cho cả script
+    line_segments = [split_text_into_segments(line, pipeline) for line in lines]
+    jobs = [
+        (line_idx, seg_idx, segment)
+        for line_idx, segments in enumerate(line_segments)
+        for seg_idx, segment in enumerate(segments)
+    ]
+    print(f"📝 Batch mode: {len(jobs)} segments from {len(lines)} lines, batch size {batch_size}")
+    
+    # Segments đã có trong cache không cần đưa vào batch
+    segment_audios = {}
+    batch_jobs = []
+    single_jobs = []
+    for line_idx, seg_idx, segment in jobs:
+        audio = tts_cache.load_cached_audio(segment_cache_key(segment[0]))
+        if audio is not None:
+            segment_audios[(line_idx, seg_idx)] = audio
+        elif segment[1] and KOKORO_AVAILABLE and pipeline:
+            batch_jobs.append((line_idx, seg_idx, segment))
+        else:
+            single_jobs.append((line_idx, seg_idx, segment))
+    print(f"💾 {len(segment_audios)} segments from cache, {len(batch_jobs) + len(single_jobs)} to synthesize")
+    
+    # Độ dài gần nhau trong cùng batch → ít padding
+    batch_jobs.sort(key=lambda job: len(job[2][1]))
+    
+    total_chars = 0
+    start = time.time()
+    for batch_start in range(0, len(batch_jobs), batch_size):
+        if cancelled and cancelled.is_set():
+            print("🛑 TTS job cancelled")
+            return 0
+        batch = batch_jobs[batch_start:batch_start + batch_size]
+        batch_chars = sum(len(segment[0]) for _, _, segment in batch)
+        batch_time = time.time()
+        try:
+            audios = pipeline.infer_batch([segment[1] for _, _, segment in batch])
+            elapsed = time.time() - batch_time
+            print(f"   🎵 Batch {batch_start // batch_size + 1}: {len(batch)} segments, "
+                  f"{batch_chars} chars, {batch_chars / max(elapsed, 1e-6):.0f} chars/s")
+        except Exception as e:
+            print(f"   ⚠️ Batch failed, synthesizing one by one: {e}")
+            single_jobs.extend(batch)
+            continue
+        for (line_idx, seg_idx, segment), audio in zip(batch, audios):
+            audio = audio.astype(AUDIO_DTYPE, copy=False)
+            tts_cache.store_cached_audio(segment_cache_key(segment[0]), audio)
+            segment_audios[(line_idx, seg_idx)] = audio
+        total_chars += batch_chars
+    
+    # Synth riêng các segment còn lại (cache/Kokoro/demo)
+    failed_lines = set()
+    for line_idx, seg_idx, segment in single_jobs:
+        if cancelled and cancelled.is_set():
+            print("🛑 TTS job cancelled")
+            return 0
+        try:
+            chunks = list(iter_segment_audio(segment, pipeline))
+        except Exception:
+            # Kokoro dừng giữa chừng: cả dòng lỗi, không ghi audio thiếu đoạn cuối
+            failed_lines.add(line_idx)
+            continue
+        if chunks:
+            segment_audios[(line_idx, seg_idx)] = np.concatenate(chunks)
+        total_chars += len(segment[0])
+    
+    elapsed = time.time() - start
+    print(f"📊 Batch synthesis: {total_chars} chars in {elapsed:.1f}s "
+          f"({total_chars / max(elapsed, 1e-6):.0f} chars/s)")
+    
+    # Ghép lại theo đúng thứ tự dòng → output_{i}.wav
+    success_count = 0
+    for line_idx, segments in enumerate(line_segments):
+        audios = [segment_audios.pop((line_idx, seg_idx))
+                  for seg_idx in range(len(segments)) if (line_idx, seg_idx) in segment_audios]
+        print(f"\n🔊 Line {line_idx+1}: {len(audios)}/{len(segments)} segments")
+        if line_idx in failed_lines:
+            print(f"❌ Kokoro failed mid-segment, skipping line {line_idx+1}")
+            continue
+        if write_line_audio(join_with_silence(audios), line_idx, output_dir):
+            success_count += 1
+    return success_count
+
+def generate_audio_pipelined(lines, pipeline, output_dir=None, cancelled=None):
+    """Pipelined mode: G2P chạy trước trên 1 thread, model synth segment trước đó.
+    
+    Phonemization (misaki/espeak, mostly Python) runs on a producer thread and
+    fills a bounded queue; the acoustic model (torch/onnxruntime release the
+    GIL) consumes it on this thread, so the two phases overlap.
+    """
+    if not (KOKORO_AVAILABLE and pipeline):
+        # Không có model thì không có gì để chạy song song
+        return generate_audio_serial(lines, pipeline, output_dir, cancelled)
+    
+    work_queue = queue.Queue(maxsize=TTS_G2P_QUEUE_SIZE)
+    busy = {"g2p": 0.0, "acoustic": 0.0}
+    
+    def produce():
+        """(line_idx, seg_idx, seg_count, text, key, phonemes, cached_audio) theo đúng thứ tự"""
+        try:
+            for line_idx, line_text in enumerate(lines):
+                if cancelled and cancelled.is_set():
+                    return
+                start = time.time()
+                try:
+                    segments = split_text_into_segments(line_text, pipeline)
+                except Exception as e:
+                    print(f"⚠️ Cannot split line {line_idx+1}: {e}")
+                    segments = [(line_text, None)]
+                # G2P của cả dòng chạy ở đây, 1 lần mỗi câu
+                busy["g2p"] += time.time() - start
+                
+                if not segments:
+                    work_queue.put((line_idx, 0, 0, None, None, None, None))
+                for seg_idx, (text, phonemes) in enumerate(segments):
+                    key = segment_cache_key(text)
+                    cached_audio = tts_cache.load_cached_audio(key)
+                    work_queue.put((line_idx, seg_idx, len(segments), text, key, phonemes, cached_audio))
+        finally:
+            work_queue.put(None)
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    wall_start = time.time()
+    producer.start()
+    
+    success_count = 0
+    line_audios = []
+    line_failed = False
+    while True:
+        item = work_queue.get()
+        if item is None:
+            break
+        if cancelled and cancelled.is_set():
+            continue  # Producer dừng ở dòng tiếp theo, chỉ cần rút hết queue
+        line_idx, seg_idx, seg_count, text, key, phonemes, audio = item
+        if seg_count == 0:
+            write_line_audio(iter(()), line_idx, output_dir)
+            continue
+        
+        if audio is None and phonemes:
+            start = time.time()
+            try:
+                audio = pipeline.infer(phonemes).astype(AUDIO_DTYPE, copy=False)
+                tts_cache.store_cached_audio(key, audio)
+            except Exception as e:
+                print(f"   ❌ Kokoro TTS error: {e}")
+                audio = None
+            busy["acoustic"] += time.time() - start
+        if audio is None and not phonemes:
+            # Không có phonemes (G2P lỗi): để backend tự G2P như serial/batch mode, demo chỉ khi Kokoro không ra gì
+            start = time.time()
+            try:
+                chunks = list(iter_segment_audio((text, None), pipeline))
+                audio = np.concatenate(chunks) if chunks else None
+            except Exception:
+                line_failed = True  # Kokoro dừng giữa chừng: cả dòng lỗi
+            busy["acoustic"] += time.time() - start
+        elif audio is None:
+            audio = create_fallback_audio(text)
+        if audio is not None:
+            line_audios.append(audio)
+        
+        # Segment cuối của dòng → ghi output_{i}
+        if seg_idx == seg_count - 1:
+            print(f"\n🔊 Line {line_idx+1}: {len(line_audios)}/{seg_count} segments")
+            if line_failed:
+                print(f"❌ Kokoro failed mid-segment, skipping line {line_idx+1}")
+            elif write_line_audio(join_with_silence(line_audios), line_idx, output_dir):
+                success_count += 1
+            line_audios = []
+            line_failed = False
+    
+    producer.join()
+    if cancelled and cancelled.is_set():
+        print("🛑 TTS job cancelled")
+        return 0
+    wall = time.time() - wall_start
+    serial = busy["g2p"] + busy["acoustic"]
+    print(f"📊 Pipelined TTS: G2P busy {busy['g2p']:.1f}s ({busy['g2p'] / max(wall, 1e-6) * 100:.0f}%), "
+          f"model busy {busy['acoustic']:.1f}s ({busy['acoustic'] / max(wall, 1e-6) * 100:.0f}%), "
+          f"wall {wall:.1f}s, speedup {serial / max(wall, 1e-6):.2f}x vs running both phases serially")
+    return success_count
+
+def get_cpu_quota():
+    """Number of CPUs the container may use (cgroup quota, then affinity)"""
+    # cgroup v2
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, int(quota) // int(period))
+    except (OSError, ValueError):
+        pass
+    
+    # cgroup v1
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r") as f:
+            period = int(f.read())
+        if quota > 0:
+            return max(1, quota // period)
+    except (OSError, ValueError):
+        pass
+    
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _init_parallel_worker(num_threads):
+    """Pool initializer: each worker gets its own KPipeline and thread share"""
+    global _worker_pipeline
+    # Backend tự set số torch threads / onnxruntime intra-op threads
+    _worker_pipeline = load_pipeline(num_threads)
+
+def _worker_ready(_):
+    return os.getpid()
+
+def _process_line_in_worker(job):
+    line_idx, line_text, output_dir = job
+    before = tts_cache.get_stats()
+    success = process_line_audio(line_text, line_idx, _worker_pipeline, output_dir)
+    after = tts_cache.get_stats()
+    # Counters sống trong worker process, gửi phần chênh lệch về process chính
+    return success, after["hits"] - before["hits"], after["misses"] - before["misses"]
+
+def get_parallel_pool():
+    """Create the worker pool once, sized so workers x threads = CPU quota"""
+    global _parallel_pool, _parallel_workers
+    if _parallel_pool is None:
+        cpu_quota = get_cpu_quota()
+        num_workers = max(1, min(TTS_WORKERS or cpu_quota // 4 or 1, cpu_quota))
+        _parallel_workers = num_workers
+        num_threads = max(1, cpu_quota // num_workers)
+        print(f"🧵 Parallel TTS: {num_workers} workers x {num_threads} torch threads (CPU quota {cpu_quota})")
+        
+        # spawn: torch không an toàn với fork
+        context = multiprocessing.get_context("spawn")
+        _parallel_pool = context.Pool(num_workers, initializer=_init_parallel_worker, initargs=(num_threads,))
+        # Wait until every worker has loaded its pipeline
+        _parallel_pool.map(_worker_ready, range(num_workers), chunksize=1)
+    return _parallel_pool
+
+def close_parallel_pool():
+    """Shut down the worker pool if it was created"""
+    global _parallel_pool
+    if _parallel_pool is not None:
+        _parallel_pool.close()
+        _parallel_pool.join()
+        _parallel_pool = None
+
+def generate_audio_parallel(lines, output_dir=None, cancelled=None):
+    """Parallel mode: shard lines across worker processes, results in line order.
+    
+    Lines are submitted one at a time with apply_async, at most one per
+    worker in flight, and cancelled is checked before every submit: a
+    cancelled job leaves only the lines already running, not the rest of the
+    script queued in the pool ahead of the next job.
+    """
+    pool = get_parallel_pool()
+    success_count = 0
+    in_flight = collections.deque()
+    next_line = 0
+    while next_line < len(lines) or in_flight:
+        if cancelled and cancelled.is_set():
+            # Chỉ còn các dòng đang chạy, chúng ghi vào output_dir của job cũ
+            print("🛑 TTS job cancelled")
+            return 0
+        while next_line < len(lines) and len(in_flight) < _parallel_workers:
+            job = (next_line, lines[next_line], output_dir)
+            in_flight.append((next_line, pool.apply_async(_process_line_in_worker, (job,))))
+            next_line += 1
+        
+        # Chờ dòng cũ nhất → kết quả theo đúng thứ tự dòng
+        line_idx, result = in_flight.popleft()
+        success, cache_hits, cache_misses = result.get()
+        tts_cache.record_stats(cache_hits, cache_misses)
+        if success:
+            success_count += 1
+        else:
+            print(f"❌ Line {line_idx+1} failed in parallel worker")
+    return success_count
+
+def prepare_tts():
+    """Load what TTS_MODE needs: the pipeline, or the warm worker pool in parallel mode"""
+    if TTS_MODE == "parallel":
+        get_parallel_pool()
+        return None
+    return load_pipeline()
+
+def generate_audio_serial(lines, pipeline, output_dir=None, cancelled=None):
+    """Serial mode: one line after another"""
+    success_count = 0
+    for line_idx, line_text in enumerate(lines):
+        if cancelled and cancelled.is_set():
+            print("🛑 TTS job cancelled")
+            return 0
+        if process_line_audio(line_text, line_idx, pipeline, output_dir):
+            success_count += 1
+    return success_count
+
+def generate_audio_for_lines(lines, pipeline, output_dir=None, cancelled=None):
+    """Create output_{i}.wav for every line, return number of successful lines.
+    
+    output_dir defaults to AUDIO_DIR. cancelled is an optional threading.Event,
+    checked between lines/batches, that stops the job early (the TTS worker
+    sets it when the client goes away).
+    """
+    tts_cache.reset_stats()
+    
+    if TTS_MODE == "batch":
+        success_count = generate_audio_batched(lines, pipeline, output_dir=output_dir, cancelled=cancelled)
+    elif TTS_MODE == "parallel":
+        success_count = generate_audio_parallel(lines, output_dir, cancelled)
+    elif TTS_MODE == "pipelined":
+        success_count = generate_audio_pipelined(lines, pipeline, output_dir, cancelled)
+    else:
+        success_count = generate_audio_serial(lines, pipeline, output_dir, cancelled)
+    
+    tts_cache.print_stats()
+    return success_count
+
+def generate_with_worker(lines):
+    """Run the job on the warm worker in a private directory, then move the files into AUDIO_DIR.
+    
+    If the request fails or times out, the worker may still be finishing the
+    job; its files stay in the job directory (removed here) instead of mixing
+    with the in-process fallback's output_{i} files. Returns None on failure.
+    """
+    job_dir = tempfile.mkdtemp(prefix=".tts-job-", dir=os.path.dirname(AUDIO_DIR))
+    try:
+        success_count = tts_worker.request_generate(lines, job_dir)
+        for name in os.listdir(job_dir):
+            shutil.move(os.path.join(job_dir, name), os.path.join(AUDIO_DIR, name))
+        return success_count
+    except Exception as e:
+        print(f"⚠️ TTS worker error, falling back to in-process TTS: {e}")
+        return None
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
 def main():
     """Main function"""
     print("🎵 Generating audio with new segmentation logic...")
@@ -333,31 +721,20 @@ def main():
 
     print(f"📝 Found {len(lines)} lines to process")
 
-    # Initialize Kokoro pipeline once (if available)  
-    kokoro_pipeline = None
-    kokoro_available = KOKORO_AVAILABLE
-    if kokoro_available:
-        try:
-            kokoro_pipeline = kokoro.KPipeline(lang_code='a')
-            print("✅ Kokoro TTS pipeline ready!")
-        except Exception as e:
-            print(f"⚠️ Cannot create Kokoro pipeline: {e}")
-            kokoro_available = False
+    # Prefer the warm TTS worker, fall back to loading the pipeline here
+    success_count = None
+    if tts_worker.is_worker_warm():
+        print("🎧 Using warm TTS worker")
+        success_count = generate_with_worker(lines)
 
-    # Process each line
-    success_count = 0
-    for line_idx, line_text in enumerate(lines):
-        if process_line_audio(line_text, line_idx, kokoro_pipeline):
-            success_count += 1
+    if success_count is None:
+        kokoro_pipeline = prepare_tts()
+        success_count = generate_audio_for_lines(lines, kokoro_pipeline)
+        close_parallel_pool()
 
     print(f"\n✅ Audio generation completed!")
     print(f"📊 Successfully processed {success_count}/{len(lines)} lines")
     
-    # Clean up temp directory
-    if os.path.exists(TEMP_AUDIO_DIR):
-        shutil.rmtree(TEMP_AUDIO_DIR)
-        print("🧹 Cleaned up temporary files")
-    
     if success_count == 0:
         print("❌ No audio files were generated!")
         return False
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Benchmarks for the video pipeline stages.
+
+Usage:
+    python benchmark.py segments [script_file]
+    python benchmark.py backends [script_file] [backend,backend,...]
+    python benchmark.py startup
+    python benchmark.py keywords [script_file] [local,batch,line]
+"""
+import io
+import os
+import sys
+import time
+import contextlib
+import numpy as np
+
+import audio_generator
+import tts_backends
+from audio_generator import split_text_into_segments
+
+# Segment size used before tokenizer-aware packing
+LEGACY_MAX_CHARS = 400
+
+# Backend comparison runs on a fixed slice of the script
+BACKEND_BENCH_LINES = 10
+
+# Keyword strategies of image_processor.generate_keywords
+KEYWORD_STRATEGIES = ["local", "batch", "line"]
+
+def read_script_lines(script_file):
+    """Non-empty lines of a script file (1 line = 1 audio = 1 image)"""
+    with open(script_file, "r", encoding="utf-8") as file:
+        return [line.strip() for line in file.readlines() if line.strip()]
+
+def load_g2p_pipeline():
+    """Kokoro pipeline without the acoustic model: G2P and chunking only"""
+    if not audio_generator.KOKORO_AVAILABLE:
+        return None
+    return tts_backends.KokoroG2P(audio_generator.LANG_CODE)
+
+def count_inference_calls(segment, g2p_pipeline):
+    """Number of model forward passes Kokoro makes for one (text, phonemes) segment"""
+    text, phonemes = segment
+    if phonemes:
+        return 1
+    if g2p_pipeline is None:
+        return 1
+    return sum(1 for _ in g2p_pipeline.phonemize(text))
+
+def benchmark_segments(script_file):
+    """Segments per line and inference calls per video, before vs after token-aware packing"""
+    lines = read_script_lines(script_file)
+    g2p_pipeline = load_g2p_pipeline()
+    if g2p_pipeline is None:
+        print("⚠️ Kokoro not available, token counts fall back to characters")
+
+    strategies = [
+        (f"before ({LEGACY_MAX_CHARS} chars)", lambda line: split_text_into_segments(line, None, LEGACY_MAX_CHARS)),
+        (f"after ({audio_generator.MAX_TOKENS_PER_SEGMENT} tokens)", lambda line: split_text_into_segments(line, g2p_pipeline)),
+    ]
+
+    print(f"📝 {len(lines)} lines, {sum(len(line) for line in lines)} chars: {script_file}")
+    print(f"{'strategy':<24}{'segments':>10}{'avg/line':>10}{'max/line':>10}{'inference calls':>17}")
+    for label, split in strategies:
+        per_line = [split(line) for line in lines]
+        counts = [len(segments) for segments in per_line]
+        calls = sum(count_inference_calls(segment, g2p_pipeline) for segments in per_line for segment in segments)
+        print(f"{label:<24}{sum(counts):>10}{sum(counts) / max(1, len(counts)):>10.2f}"
+              f"{max(counts, default=0):>10}{calls:>17}")
+    return True
+
+def log_spectral_distance(reference, candidate, frame=1024, hop=256):
+    """Mean log-spectral distance (dB) between two signals, truncated to the shorter one"""
+    length = min(len(reference), len(candidate))
+    if length < frame:
+        return float("nan")
+    window = np.hanning(frame).astype(np.float32)
+
+    def log_spectrum(audio):
+        frames = np.lib.stride_tricks.sliding_window_view(np.asarray(audio[:length]), frame)[::hop] * window
+        return 20 * np.log10(np.abs(np.fft.rfft(frames, axis=1)) + 1e-6)
+
+    diff = log_spectrum(reference) - log_spectrum(candidate)
+    return float(np.mean(np.sqrt(np.mean(diff ** 2, axis=1))))
+
+def benchmark_backends(script_file, names):
+    """Real-time factor and difference from the first backend, on a fixed script slice"""
+    lines = read_script_lines(script_file)[:BACKEND_BENCH_LINES]
+    g2p_pipeline = load_g2p_pipeline()
+    if g2p_pipeline is None:
+        print("❌ Kokoro not available")
+        return False
+
+    # Same segments for every backend
+    segments = [segment for line in lines for segment in split_text_into_segments(line, g2p_pipeline)]
+    print(f"📝 {len(lines)} lines, {len(segments)} segments, {sum(len(text) for text, _ in segments)} chars")
+    print(f"{'backend':<12}{'load s':>8}{'synth s':>9}{'audio s':>9}{'RTF':>7}{'LSD dB':>8}{'dur ratio':>11}")
+
+    reference = None
+    for name in names:
+        start = time.time()
+        try:
+            backend = tts_backends.load_backend(name, audio_generator.LANG_CODE, audio_generator.VOICE)
+        except Exception as e:
+            print(f"{name:<12}skipped: {e}")
+            continue
+        load_seconds = time.time() - start
+
+        list(backend.synthesize("Warm up."))  # First call allocates, not measured
+
+        start = time.time()
+        audios = []
+        for text, _ in segments:
+            chunks = list(backend.synthesize(text))
+            audios.append(np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32))
+        synth_seconds = time.time() - start
+        audio_seconds = sum(len(audio) for audio in audios) / audio_generator.SAMPLE_RATE
+
+        if reference is None:
+            reference = audios
+        distances = [log_spectral_distance(ref, audio) for ref, audio in zip(reference, audios)]
+        lsd = float(np.nanmean(distances)) if distances else float("nan")
+        duration_ratio = sum(len(a) for a in audios) / max(1, sum(len(r) for r in reference))
+
+        print(f"{name:<12}{load_seconds:>8.1f}{synth_seconds:>9.1f}{audio_seconds:>9.1f}"
+              f"{synth_seconds / max(audio_seconds, 1e-6):>7.3f}{lsd:>8.2f}{duration_ratio:>11.3f}")
+    return reference is not None
+
+def container_start_time():
+    """Epoch time PID 1 started (the container start inside Docker), None if unknown"""
+    try:
+        with open("/proc/1/stat", "r") as file:
+            # Field 22 = starttime (clock ticks since boot); comm có thể chứa dấu cách
+            start_ticks = int(file.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat", "r") as file:
+            boot_time = next(int(line.split()[1]) for line in file if line.startswith("btime"))
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+    return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+
+def benchmark_startup():
+    """Time from container start to the first synthesized segment"""
+    started_at = container_start_time()
+    imported_at = time.time()  # torch/kokoro đã được import ở đầu file
+    print(f"📦 Local model snapshot: {tts_backends.has_local_model()} ({tts_backends.MODEL_DIR}), "
+          f"HF_HUB_OFFLINE={os.getenv('HF_HUB_OFFLINE', '0')}")
+
+    pipeline = audio_generator.load_pipeline()
+    loaded_at = time.time()
+    if pipeline is None:
+        print("❌ Kokoro not available")
+        return False
+
+    chunks = list(pipeline.synthesize("This is the first segment of the video."))
+    first_segment_at = time.time()
+
+    if started_at is not None:
+        print(f"⏱️ container start -> imports done: {imported_at - started_at:.1f}s")
+    print(f"⏱️ pipeline load: {loaded_at - imported_at:.1f}s")
+    print(f"⏱️ first segment: {first_segment_at - loaded_at:.1f}s ({sum(len(c) for c in chunks) / audio_generator.SAMPLE_RATE:.1f}s audio)")
+    if started_at is not None:
+        print(f"🏁 container start -> first segment: {first_segment_at - started_at:.1f}s")
+    return True
+
+def benchmark_keywords(script_file, strategies):
+    """Keyword latency per video for each strategy, LLM cache off so every call is real"""
+    lines = read_script_lines(script_file)
+    print(f"📝 {len(lines)} lines: {script_file}")
+    if "local" in strategies:
+        import keyword_extractor
+        start = time.time()
+        nlp = keyword_extractor.load_spacy()  # Load 1 lần mỗi process, không tính vào latency
+        print(f"🔤 local: {'spaCy ' + keyword_extractor.SPACY_MODEL if nlp else 'stopword chunking'}, "
+              f"loaded in {time.time() - start:.2f}s")
+
+    results = []
+    for strategy in strategies:
+        start = time.time()
+        try:
+            if strategy == "local":
+                keywords = keyword_extractor.extract_keywords(lines)
+            else:
+                import llm_cache
+                import image_processor
+                llm_cache.CACHE_MODE = "off"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    keywords = image_processor.generate_keywords(lines, mode=strategy)
+        except Exception as e:
+            print(f"{strategy:<8}skipped: {e}")
+            continue
+        results.append((strategy, time.time() - start, keywords))
+
+    print(f"{'strategy':<10}{'video s':>9}{'ms/line':>9}{'distinct':>10}  first keywords")
+    for strategy, seconds, keywords in results:
+        print(f"{strategy:<10}{seconds:>9.2f}{seconds * 1000 / max(1, len(lines)):>9.1f}"
+              f"{len(set(keywords)):>10}  {' | '.join(keyword[:40] for keyword in keywords[:3])}")
+    return bool(results)
+
+def main():
+    """Main function"""
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return False
+
+    command = sys.argv[1]
+    if command == "segments":
+        script_file = sys.argv[2] if len(sys.argv) > 2 else audio_generator.SCRIPT_FILE
+        if not os.path.exists(script_file):
+            print(f"❌ Script file not found: {script_file}")
+            return False
+        return benchmark_segments(script_file)
+
+    if command == "backends":
+        script_file = sys.argv[2] if len(sys.argv) > 2 else audio_generator.SCRIPT_FILE
+        names = sys.argv[3].split(",") if len(sys.argv) > 3 else list(tts_backends.BACKENDS)
+        if not os.path.exists(script_file):
+            print(f"❌ Script file not found: {script_file}")
+            return False
+        return benchmark_backends(script_file, names)
+
+    if command == "startup":
+        return benchmark_startup()
+
+    if command == "keywords":
+        script_file = sys.argv[2] if len(sys.argv) > 2 else audio_generator.SCRIPT_FILE
+        strategies = sys.argv[3].split(",") if len(sys.argv) > 3 else KEYWORD_STRATEGIES
+        if not os.path.exists(script_file):
+            print(f"❌ Script file not found: {script_file}")
+            return False
+        return benchmark_keywords(script_file, strategies)
+
+    print(f"❌ Unknown benchmark: {command}")
+    print(__doc__)
+    return False
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
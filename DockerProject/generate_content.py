@@ -1,9 +1,26 @@
 #!/usr/bin/env python3
 import os
-import openai
+import io
+import re
 import json
+import time
+import asyncio
+import contextlib
+import concurrent.futures
 from dotenv import load_dotenv
 
+import llm_batch
+import llm_cache
+import llm_gateway
+import llm_telemetry
+import tts_worker
+
+try:
+    import tiktoken
+    TOKENIZER = tiktoken.get_encoding("o200k_base")
+except Exception:
+    TOKENIZER = None
+
 # Load environment variables
 load_dotenv()
 
@@ -12,31 +29,290 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
-# Initialize OpenAI client
-client = openai.OpenAI(api_key=api_key)
+# Initialize OpenAI client (through the LLM gateway when it is running)
+client = llm_gateway.create_client(api_key)
+async_client = None  # AsyncOpenAI, created on first use in async mode
 
 # Configuration
 MIN_WORD_COUNT = 1500
+MAX_TOKENS = 4000
+MIN_PARAGRAPH_COUNT = 10
+EXPAND_MODE = os.getenv("EXPAND_MODE", "continue")  # continue | rewrite
+MAX_EXPAND_ROUNDS = 3  # Số lần xin thêm đoạn tối đa (continue mode)
+WORDS_PER_NEW_PARAGRAPH = 120
+PARAGRAPH_SENTENCES = (4, 6)  # Số câu mỗi đoạn khi chia lại narration
+
+# Sentence end: . ! ? (có thể kèm dấu đóng ngoặc/nháy) rồi khoảng trắng
+SENTENCE_END = re.compile(r'(?<=[.!?])["\')\]”’]*\s+')
+ABBREVIATIONS = ("Mr.", "Mrs.", "Ms.", "Dr.", "Prof.", "St.", "vs.", "etc.", "e.g.", "i.e.", "U.S.", "U.K.", "No.", "a.m.", "p.m.")
+CONTENT_MODE = os.getenv("CONTENT_MODE", "serial")  # serial | async | batch
+BATCH_MAX_ATTEMPTS = 3  # Số lần gửi lại 1 request lỗi trong batch mode
+CONTENT_CONCURRENCY = int(os.getenv("CONTENT_CONCURRENCY", "8"))  # Số subject chạy đồng thời (async mode)
+COMPACT_CONTEXT = os.getenv("COMPACT_CONTEXT", "0") == "1"  # Digest các bước trước thay vì chèn nguyên văn vào script prompt
+DIGEST_LIMITS = {"sections": 15, "facts": 30, "points": 20, "hooks": 15}
+DIGEST_ITEM_CHARS = 200
+NARRATION_STREAM = os.getenv("NARRATION_STREAM", "0") == "1"  # Stream narration, gửi từng đoạn xong cho TTS worker
+SYSTEM_PROMPT = "You are a professional video script writer. You help create engaging, insightful, and interesting content in English."
+
+# Per-run totals for the latency/token report
+_run_stats = {"subjects": 0, "seconds": 0.0, "script_prompt_tokens": 0}
 
 # Paths
 SUBJECTS_FILE = "/app/subjects.txt"
 CONTENT_FILE = "/app/temp/content.txt"
 
-def call_llm(prompt, model="gpt-4o-mini", temperature=0.7):
-    """Call LLM with prompt and return result"""
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are a professional video script writer. You help create engaging, insightful, and interesting content in English."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=temperature,
-        max_tokens=4000
-    )
-    return response.choices[0].message.content
+def build_messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
 
-def generate_content_for_subject(title):
-    """Generate content for a specific title"""
+class ParagraphStream:
+    """Collect streamed text and pass every paragraph to on_paragraph as soon as it is complete"""
+    
+    def __init__(self, on_paragraph):
+        self.on_paragraph = on_paragraph
+        self.text = ""
+        self.sent = 0
+    
+    def feed(self, delta):
+        self.text += delta
+        while True:
+            end = self.text.find("\n\n", self.sent)
+            if end < 0:
+                return
+            self._emit(self.text[self.sent:end])
+            self.sent = end + 2
+    
+    def restart(self):
+        """Drop the partial text of a stream that broke off; paragraphs already passed on stay sent"""
+        self.text = ""
+        self.sent = 0
+    
+    def close(self):
+        """Flush the last paragraph and return the full text"""
+        self._emit(self.text[self.sent:])
+        self.sent = len(self.text)
+        return self.text
+    
+    def _emit(self, paragraph):
+        if paragraph.strip():
+            self.on_paragraph(paragraph.strip())
+
+# 1 thread gửi prefetch theo thứ tự, stream và event loop không phải chờ socket
+_prefetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+def _send_prefetch(lines):
+    if not TTSPrefetcher.reachable:
+        return
+    if not tts_worker.request_prefetch(lines):
+        print("⚠️ TTS worker not reachable, narration not prefetched")
+        TTSPrefetcher.reachable = False
+
+class TTSPrefetcher:
+    """Queue one subject's narration lines on the TTS worker as they are produced.
+    
+    Called with each paragraph of the streamed narration as soon as it is
+    complete. finish() then sends the lines of the final script that expand or
+    the paragraph re-split added or changed, so every line audio_generator
+    will see is in the TTS cache; lines already sent are not sent again.
+    """
+    reachable = True
+    
+    def __init__(self, title):
+        self.title = title
+        self.started_at = time.time()
+        self.sent = set()
+    
+    def __call__(self, paragraph):
+        # create_plan tách script theo dòng, 1 dòng = 1 audio
+        first = not self.sent
+        self._send([line.strip() for line in paragraph.split("\n") if line.strip()])
+        if first and self.sent:
+            print(f"🔊 First paragraph of {self.title} sent to TTS after {time.time() - self.started_at:.1f}s")
+    
+    def finish(self, content):
+        # Bỏ dòng Mytitle
+        lines = [line.strip() for line in content.split("\n")[1:] if line.strip()]
+        streamed = sum(1 for line in lines if line in self.sent)
+        self._send(lines)
+        print(f"🔊 {self.title}: {streamed}/{len(lines)} final lines were streamed to TTS, "
+              f"{len(lines) - streamed} sent now")
+    
+    def _send(self, lines):
+        lines = [line for line in dict.fromkeys(lines) if line not in self.sent]
+        if lines:
+            self.sent.update(lines)
+            _prefetch_executor.submit(_send_prefetch, lines)
+
+def call_llm(prompt, model="gpt-4o-mini", temperature=0.7, on_paragraph=None, step=None, subject=None):
+    """Call LLM with prompt and return result (cached, see llm_cache).
+    
+    The answer is always streamed so llm_telemetry can record time to first
+    token. With on_paragraph each finished paragraph is handed to on_paragraph
+    while the rest is still being generated.
+    """
+    messages = build_messages(prompt)
+    paragraphs = ParagraphStream(on_paragraph) if on_paragraph else None
+    
+    def create():
+        text = llm_telemetry.streamed_completion(
+            client, step, subject,
+            on_delta=paragraphs.feed if paragraphs else None,
+            on_restart=paragraphs.restart if paragraphs else None,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=MAX_TOKENS
+        )
+        return paragraphs.close() if paragraphs else text
+    
+    result = llm_cache.cached_completion(create, model, messages, temperature, MAX_TOKENS,
+                                         on_hit=lambda: llm_telemetry.record_cache_hit(step, subject, model))
+    if paragraphs is not None and not paragraphs.text:
+        # Cache hit: không stream nhưng vẫn gửi từng đoạn
+        paragraphs.feed(result)
+        paragraphs.close()
+    return result
+
+async def call_llm_async(prompt, model="gpt-4o-mini", temperature=0.7, on_paragraph=None, step=None, subject=None):
+    """Async version of call_llm (AsyncOpenAI)"""
+    global async_client
+    if async_client is None:
+        async_client = llm_gateway.create_client(api_key, async_client=True)
+    messages = build_messages(prompt)
+    paragraphs = ParagraphStream(on_paragraph) if on_paragraph else None
+    
+    async def create():
+        text = await llm_telemetry.streamed_completion_async(
+            async_client, step, subject,
+            on_delta=paragraphs.feed if paragraphs else None,
+            on_restart=paragraphs.restart if paragraphs else None,
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=MAX_TOKENS
+        )
+        return paragraphs.close() if paragraphs else text
+    
+    result = await llm_cache.cached_completion_async(create, model, messages, temperature, MAX_TOKENS,
+                                                     on_hit=lambda: llm_telemetry.record_cache_hit(step, subject, model))
+    if paragraphs is not None and not paragraphs.text:
+        paragraphs.feed(result)
+        paragraphs.close()
+    return result
+
+def split_sentences(text):
+    """Split text at sentence boundaries, keeping every character except the separating whitespace"""
+    sentences = []
+    current = ""
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        current += text[start:match.start()] + text[match.start():match.end()].rstrip()
+        start = match.end()
+        # "Dr. Smith" không phải cuối câu
+        if current.endswith(ABBREVIATIONS):
+            current += " "
+            continue
+        sentences.append(current)
+        current = ""
+    current += text[start:]
+    if current.strip():
+        sentences.append(current.strip())
+    return sentences
+
+def split_into_paragraphs(text, min_sentences=PARAGRAPH_SENTENCES[0], max_sentences=PARAGRAPH_SENTENCES[1],
+                          min_paragraphs=MIN_PARAGRAPH_COUNT):
+    """Regroup the whole narration into paragraphs of min-max sentences without changing any word.
+    
+    All sentences are cut into evenly sized groups, the shorter ones last (only
+    the final group may drop below min_sentences, e.g. 7 sentences -> 4, 3).
+    Groups are made smaller, down to min_sentences, to reach min_paragraphs
+    when the narration has enough sentences.
+    """
+    sentences = []
+    for paragraph in text.split("\n\n"):
+        sentences.extend(split_sentences(" ".join(paragraph.split())))
+    if not sentences:
+        return ""
+    group_count = max(1, -(-len(sentences) // max_sentences), min(min_paragraphs, len(sentences) // min_sentences))
+    # Chia đều: 13 câu -> 5, 4, 4 thay vì 6, 6, 1
+    base, extra = divmod(len(sentences), group_count)
+    paragraphs = []
+    start = 0
+    for i in range(group_count):
+        size = base + (1 if i < extra else 0)
+        paragraphs.append(" ".join(sentences[start:start + size]))
+        start += size
+    return "\n\n".join(paragraphs)
+
+def insert_paragraphs(paragraphs, new_text):
+    """Insert "[N] text" paragraphs after paragraph N (1-based, 0 = before the first); unmarked text is appended"""
+    parts = re.split(r'(?m)^\s*\[(\d+)\]\s*', new_text)
+    inserted = {}
+    unmarked = [p.strip() for p in parts[0].split("\n\n") if p.strip()]
+    for position, text in zip(parts[1::2], parts[2::2]):
+        position = min(int(position), len(paragraphs))
+        inserted.setdefault(position, []).extend(p.strip() for p in text.split("\n\n") if p.strip())
+    
+    result = inserted.get(0, [])
+    for i, paragraph in enumerate(paragraphs):
+        result.append(paragraph)
+        result.extend(inserted.get(i + 1, []))
+    return "\n\n".join(result + unmarked)
+
+def estimate_tokens(text):
+    """Token count with tiktoken if installed, otherwise ~4 characters per token"""
+    if TOKENIZER is not None:
+        return len(TOKENIZER.encode(text))
+    return len(text) // 4
+
+def _shorten(text, limit=DIGEST_ITEM_CHARS):
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "..."
+
+def compact_context(text):
+    """Local digest of an earlier step's answer: section titles, facts with numbers, key points and hooks"""
+    digest = {name: [] for name in DIGEST_LIMITS}
+    for raw_line in text.splitlines():
+        line = raw_line.strip()
+        clean = re.sub(r'^(?:(?:[#>*\-•]+|\d+[.)])\s*)+', '', line).replace("**", "").strip()
+        if not clean:
+            continue
+        # "### Title", "**Title**", "Title:" -> tiêu đề section
+        if line.startswith("#") or (line.startswith("**") and line.rstrip(":").endswith("**")) \
+                or (clean.endswith(":") and len(clean.split()) <= 10):
+            digest["sections"].append(clean.rstrip(":"))
+            continue
+        is_list_item = clean != line.replace("**", "").strip()
+        for sentence in split_sentences(clean):
+            if sentence.endswith(("?", '?"', "?”")) or sentence.startswith(('"', "“")):
+                digest["hooks"].append(sentence)
+            elif re.search(r'\d', sentence):
+                digest["facts"].append(sentence)
+            elif is_list_item:
+                digest["points"].append(sentence)
+    
+    parts = []
+    for name, limit in DIGEST_LIMITS.items():
+        items = list(dict.fromkeys(_shorten(item) for item in digest[name]))[:limit]
+        if items:
+            parts.append(f"{name.upper()}:\n" + "\n".join(f"- {item}" for item in items))
+    return "\n".join(parts)
+
+def llm_request(step, prompt, model="gpt-4o-mini", temperature=0.7, stream=False):
+    """One LLM call of the chain, yielded by subject_steps (stream: send paragraphs to TTS as they arrive)"""
+    return {"step": step, "prompt": prompt, "model": model, "temperature": temperature, "stream": stream}
+
+def subject_steps(title):
+    """The prompt chain for one title as a generator.
+    
+    Yields an llm_request for every call and receives the model's answer back
+    through send(); the finished content is the generator's return value. The
+    same chain is driven synchronously or with asyncio (see the two
+    generate_content_for_subject* functions).
+    """
     print(f"Generating content for: {title}")
     
     # Step 1: Topic analysis
@@ -51,7 +327,7 @@ def generate_content_for_subject(title):
     Please provide a detailed and well-structured response.
     """
     
-    analysis_result = call_llm(analysis_prompt)
+    analysis_result = yield llm_request("analysis", analysis_prompt)
     print("✅ Topic analysis completed!")
     
     # Step 2: Content structure
@@ -73,7 +349,7 @@ def generate_content_for_subject(title):
     Please provide a detailed, information-rich structure.
     """
     
-    structure_result = call_llm(structure_prompt)
+    structure_result = yield llm_request("structure", structure_prompt)
     print("✅ Content structure completed!")
     
     # Step 3: Research and details
@@ -93,7 +369,7 @@ def generate_content_for_subject(title):
     Please provide detailed, accurate, and interesting information.
     """
     
-    details_result = call_llm(details_prompt)
+    details_result = yield llm_request("details", details_prompt)
     print("✅ Content details completed!")
     
     # Step 4: Hooks and questions
@@ -112,12 +388,20 @@ def generate_content_for_subject(title):
     Ensure these elements are tightly connected to the content and create coherence.
     """
     
-    hooks_result = call_llm(hooks_prompt)
+    hooks_result = yield llm_request("hooks", hooks_prompt)
     print("✅ Hooks and questions completed!")
     
     # Step 5: Complete script synthesis
     target_word_count = max(2500, int(MIN_WORD_COUNT * 1.2))
     
+    if COMPACT_CONTEXT:
+        full_context_tokens = estimate_tokens(analysis_result + structure_result + details_result + hooks_result)
+        analysis_result, structure_result, details_result, hooks_result = (
+            compact_context(text) for text in (analysis_result, structure_result, details_result, hooks_result)
+        )
+        compact_tokens = estimate_tokens(analysis_result + structure_result + details_result + hooks_result)
+        print(f"📉 Compacted context: {full_context_tokens} -> {compact_tokens} tokens")
+    
     script_prompt = f"""
     Synthesize a complete, detailed video script about the topic "{title}" based on the following parts:
     
@@ -144,7 +428,7 @@ def generate_content_for_subject(title):
     This should be a complete script, ready for video production.
     """
     
-    script_result = call_llm(script_prompt, temperature=0.8)
+    script_result = yield llm_request("script", script_prompt, temperature=0.8)
     print("✅ Complete script completed!")
     
     # Step 6: Convert to natural narration
@@ -166,7 +450,7 @@ def generate_content_for_subject(title):
     The result should be multiple natural paragraphs, with spaces between paragraphs, without too much special formatting.
     """
     
-    narration_result = call_llm(narration_prompt, model="gpt-4o-mini", temperature=0.7)
+    narration_result = yield llm_request("narration", narration_prompt, model="gpt-4o-mini", temperature=0.7, stream=NARRATION_STREAM)
     print("✅ Narration conversion completed!")
     
     # Check paragraph count and word count
@@ -176,7 +460,39 @@ def generate_content_for_subject(title):
     print(f"Word count: {word_count}")
     
     # Ensure content is long enough
-    if word_count < MIN_WORD_COUNT:
+    expand_round = 0
+    while EXPAND_MODE == "continue" and word_count < MIN_WORD_COUNT and expand_round < MAX_EXPAND_ROUNDS:
+        # Chỉ xin phần còn thiếu, không viết lại cả bài
+        expand_round += 1
+        missing_words = MIN_WORD_COUNT - word_count
+        new_paragraph_count = max(1, -(-missing_words // WORDS_PER_NEW_PARAGRAPH))
+        print(f"Content too short ({word_count} words < {MIN_WORD_COUNT} words), adding {new_paragraph_count} paragraphs...")
+        paragraphs = [p.strip() for p in narration_result.split("\n\n") if p.strip()]
+        numbered_narration = "\n\n".join(f"[{i + 1}] {p}" for i, p in enumerate(paragraphs))
+        expand_prompt = f"""
+        Here is a narration, with each paragraph numbered:
+
+        {numbered_narration}
+
+        Write {new_paragraph_count} NEW paragraphs (about {missing_words + 50} words in total) that extend this narration by:
+        1. Delving deeper into examples and applications
+        2. Adding information about history and related research
+        3. Including more findings and debates
+        4. Expanding explanations of complex concepts
+        
+        Please ensure:
+        - Return ONLY the new paragraphs, do not repeat or rewrite existing ones
+        - Start each new paragraph with the number of the existing paragraph it should follow, e.g. "[3] ..."
+        - Separate paragraphs with a double line break
+        - Same tone as the narration, no titles, no special formatting
+        """
+        
+        new_paragraphs = yield llm_request("expand", expand_prompt, model="gpt-4o-mini", temperature=0.7)
+        narration_result = insert_paragraphs(paragraphs, new_paragraphs)
+        word_count = len(narration_result.split())
+        print(f"Expanded narration. New word count: {word_count}")
+    
+    if EXPAND_MODE == "rewrite" and word_count < MIN_WORD_COUNT:
         print(f"Content too short ({word_count} words < {MIN_WORD_COUNT} words), expanding...")
         expand_prompt = f"""
         Here is a narration:
@@ -197,36 +513,221 @@ def generate_content_for_subject(title):
         - Total word count EXACTLY between {MIN_WORD_COUNT} and {MIN_WORD_COUNT + 500} words
         """
         
-        narration_result = call_llm(expand_prompt, model="gpt-4o-mini", temperature=0.7)
+        narration_result = yield llm_request("expand", expand_prompt, model="gpt-4o-mini", temperature=0.7)
         new_word_count = len(narration_result.split())
         print(f"Expanded narration. New word count: {new_word_count}")
     
-    if paragraph_count < 10:
+    paragraph_count = len([p for p in narration_result.split("\n\n") if p.strip()])
+    if paragraph_count < MIN_PARAGRAPH_COUNT:
+        # Chia lại tại ranh giới câu, không cần gọi LLM và giữ nguyên từng từ
         print("Too few paragraphs, adjusting...")
-        adjust_prompt = f"""
-        Here is a narration:
-
-        {narration_result}
-
-        Please divide it into more paragraphs for easier reading. Each paragraph should contain only 4-6 related sentences.
-        
-        Need at least 15-20 separate paragraphs.
-        
-        Please ensure:
-        - Each paragraph has space from others (double line break between paragraphs)
-        - Content remains continuous and coherent
-        - No titles or numbering for paragraphs
-        - Everything is still one continuous piece, just divided into more paragraphs for readability
-        - Word count remains the same, content not changed
-        """
-        
-        narration_result = call_llm(adjust_prompt, model="gpt-4o-mini", temperature=0.7)
+        narration_result = split_into_paragraphs(narration_result)
         new_paragraph_count = len([p for p in narration_result.split('\n\n') if p.strip()])
         print(f"Adjusted narration. New paragraph count: {new_paragraph_count}")
+        if new_paragraph_count < MIN_PARAGRAPH_COUNT:
+            sentence_count = len(split_sentences(" ".join(narration_result.split())))
+            print(f"⚠️ Only {sentence_count} sentences, cannot make {MIN_PARAGRAPH_COUNT} paragraphs "
+                  f"of {PARAGRAPH_SENTENCES[0]}-{PARAGRAPH_SENTENCES[1]} sentences")
     
     # Return result
     return f"Mytitle: {title}\n{narration_result}"
 
+def record_request_stats(step, messages):
+    """Count one request in _run_stats; called once per answered request, never during a replay"""
+    if step == "script":
+        _run_stats["script_prompt_tokens"] += estimate_tokens("".join(message["content"] for message in messages))
+
+def record_subject_time(title, started_at):
+    seconds = time.time() - started_at
+    _run_stats["subjects"] += 1
+    _run_stats["seconds"] += seconds
+    print(f"⏱️ {title}: {seconds:.1f}s")
+
+def print_run_stats():
+    """Average end-to-end latency and script prompt size per subject"""
+    subjects = max(1, _run_stats["subjects"])
+    print(f"📊 {_run_stats['subjects']} subjects, {_run_stats['seconds'] / subjects:.1f}s per subject, "
+          f"script prompt {_run_stats['script_prompt_tokens'] // subjects} tokens on average "
+          f"(compact context {'on' if COMPACT_CONTEXT else 'off'})")
+
+def generate_content_for_subject(title):
+    """Generate content for a specific title"""
+    started_at = time.time()
+    steps = subject_steps(title)
+    prefetcher = TTSPrefetcher(title) if NARRATION_STREAM else None
+    response = None
+    while True:
+        try:
+            request = steps.send(response)
+        except StopIteration as done:
+            record_subject_time(title, started_at)
+            if prefetcher:
+                prefetcher.finish(done.value)
+            return done.value
+        record_request_stats(request["step"], build_messages(request["prompt"]))
+        response = call_llm(request["prompt"], model=request["model"], temperature=request["temperature"],
+                            on_paragraph=prefetcher if request["stream"] else None,
+                            step=request["step"], subject=title)
+
+async def generate_content_for_subject_async(title, semaphore):
+    """Same chain as generate_content_for_subject, at most CONTENT_CONCURRENCY subjects at a time"""
+    async with semaphore:
+        started_at = time.time()
+        steps = subject_steps(title)
+        prefetcher = TTSPrefetcher(title) if NARRATION_STREAM else None
+        response = None
+        while True:
+            try:
+                request = steps.send(response)
+            except StopIteration as done:
+                record_subject_time(title, started_at)
+                if prefetcher:
+                    prefetcher.finish(done.value)
+                return done.value
+            record_request_stats(request["step"], build_messages(request["prompt"]))
+            response = await call_llm_async(request["prompt"], model=request["model"], temperature=request["temperature"],
+                                            on_paragraph=prefetcher if request["stream"] else None,
+                                            step=request["step"], subject=title)
+
+def advance_subject(title, responses, queued=()):
+    """Replay recorded responses through subject_steps, then answer what the LLM cache can.
+    
+    Returns (next llm_request, None), or (None, content) once the chain is done.
+    New cache hits are appended to responses. Run stats are recorded only for
+    those new answers; the replayed part was counted when it was first answered.
+    Requests whose cache key is in queued already missed the cache and went into
+    a batch, so they are not looked up (and counted as a miss) again.
+    """
+    steps = subject_steps(title)
+    try:
+        # Các bước đã có câu trả lời in lại log cũ, bỏ qua
+        with contextlib.redirect_stdout(io.StringIO()):
+            request = steps.send(None)
+            for response in responses:
+                request = steps.send(response)
+        while True:
+            key = llm_cache.cache_key(request["model"], request["temperature"], build_messages(request["prompt"]), MAX_TOKENS)
+            if key in queued:
+                return request, None
+            cached = llm_cache.lookup(key)
+            if cached is None:
+                return request, None
+            record_request_stats(request["step"], build_messages(request["prompt"]))
+            responses.append(cached)
+            request = steps.send(cached)
+    except StopIteration as done:
+        return None, done.value
+
+def generate_contents_batch(subjects):
+    """Batch mode: every subject's next step goes into one Batch API job, all subjects advance together.
+    
+    State (responses per subject, in-flight batch id) is saved after every
+    change, so an interrupted run resumes where it stopped. A subject's time
+    in the run stats is measured from the start of this run to the round that
+    finished it.
+    """
+    run_started_at = time.time()
+    finished = set()
+    state_path = os.path.join(llm_batch.BATCH_DIR, "state.json")
+    state = llm_batch.load_state(state_path)
+    if state and state.get("subjects") == subjects:
+        print(f"♻️ Resuming batch run at round {state['round']}")
+    else:
+        state = {"subjects": subjects, "responses": [[] for _ in subjects], "attempts": {}, "queued": [], "batch_id": None, "round": 0}
+    queued = set(state.setdefault("queued", []))
+    
+    while True:
+        pending = {}
+        contents = [None] * len(subjects)
+        for i, subject in enumerate(subjects):
+            request, contents[i] = advance_subject(subject, state["responses"][i], queued)
+            if contents[i] is not None and i not in finished:
+                finished.add(i)
+                record_subject_time(subject, run_started_at)
+            if request is not None:
+                body = {
+                    "model": request["model"],
+                    "messages": build_messages(request["prompt"]),
+                    "temperature": request["temperature"],
+                    "max_tokens": MAX_TOKENS,
+                }
+                key = llm_cache.cache_key(body["model"], body["temperature"], body["messages"], MAX_TOKENS)
+                pending[f"{i}-{len(state['responses'][i])}"] = {"step": request["step"], "body": body, "key": key}
+                queued.add(key)
+        state["queued"] = sorted(queued)
+        llm_batch.save_state(state_path, state)
+        if not pending:
+            break
+        
+        steps = sorted({job["step"] for job in pending.values()})
+        started_at = time.time()
+        job_file = llm_batch.job_file_path(state["round"])
+        if state["batch_id"] is None:
+            llm_batch.write_job_file(job_file, {custom_id: job["body"] for custom_id, job in pending.items()})
+            state["batch_id"] = llm_batch.submit_job_file(client, job_file)
+            llm_batch.save_state(state_path, state)
+        print(f"📦 Round {state['round']}: {len(pending)} requests ({', '.join(steps)}), batch {state['batch_id']}")
+        
+        batch = llm_batch.wait_for_batch(client, state["batch_id"])
+        outputs = llm_batch.read_outputs(client, batch)
+        results = llm_batch.read_results(outputs)
+        # Mỗi request trong batch có latency = thời gian của cả batch
+        latency = time.time() - started_at
+        if batch.created_at and batch.completed_at:
+            latency = batch.completed_at - batch.created_at
+        for custom_id, job in pending.items():
+            subject_index = int(custom_id.split("-")[0])
+            llm_telemetry.record_batch_response(job["step"], subjects[subject_index], job["body"]["model"],
+                                                outputs.get(custom_id), latency, state["attempts"].get(custom_id, 0))
+            if results.get(custom_id) is None:
+                state["attempts"][custom_id] = state["attempts"].get(custom_id, 0) + 1
+                if state["attempts"][custom_id] >= BATCH_MAX_ATTEMPTS:
+                    raise RuntimeError(f"Batch request {custom_id} ({job['step']}) failed {BATCH_MAX_ATTEMPTS} times")
+                continue
+            state["responses"][subject_index].append(results[custom_id])
+            record_request_stats(job["step"], job["body"]["messages"])
+            llm_cache.store(job["key"], job["body"]["model"], results[custom_id])
+            queued.discard(job["key"])
+        print(f"✅ Round {state['round']}: batch {batch.status}, {len(results)}/{len(pending)} answered in {time.time() - started_at:.0f}s")
+        state["batch_id"] = None
+        state["round"] += 1
+        state["queued"] = sorted(queued)
+        llm_batch.save_state(state_path, state)
+        if os.path.exists(job_file):
+            os.remove(job_file)
+    
+    # Xong hết: xoá state và file job, lần sau chạy lại từ đầu
+    llm_batch.remove_run_files(state_path)
+    return contents
+
+def format_subject_content(subject, content):
+    """Keep only the thumbnail part of a "thumbnail | title" subject in the Mytitle line"""
+    # Extract thumbnail part from "thumbnail | title" format if exists
+    thumbnail = subject.split(" | ")[0] if " | " in subject else subject
+    
+    # Split content
+    content_parts = content.split('\n')
+    # Recreate content with only thumbnail part
+    new_content = ['Mytitle: ' + thumbnail] + content_parts[1:]
+    # Join parts back with \n
+    return '\n'.join(new_content)
+
+async def write_contents_async(subjects, output_file):
+    """Run subjects concurrently, write each one in subjects.txt order as soon as it and all before it are done"""
+    semaphore = asyncio.Semaphore(max(1, CONTENT_CONCURRENCY))
+    tasks = [asyncio.create_task(generate_content_for_subject_async(subject, semaphore)) for subject in subjects]
+    try:
+        for subject, task in zip(subjects, tasks):
+            content = await task
+            print(f"\n--- Completed topic: {subject} ---")
+            output_file.write(format_subject_content(subject, content) + "\n\n")
+            output_file.flush()
+    finally:
+        for task in tasks:
+            task.cancel()
+        if async_client is not None:
+            await async_client.close()
+
 def main():
     print("Starting content generation for each topic...")
     
@@ -238,21 +739,21 @@ def main():
     
     # Generate content and save to file
     with open(CONTENT_FILE, "w", encoding="utf-8") as output_file:
-        for subject in subjects:
-            print(f"\n--- Processing topic: {subject} ---")
-            # Extract thumbnail part from "thumbnail | title" format if exists
-            thumbnail = subject.split(" | ")[0] if " | " in subject else subject
-            content = generate_content_for_subject(subject)
-            
-            # Split content
-            content_parts = content.split('\n')
-            # Recreate content with only thumbnail part
-            new_content = ['Mytitle: ' + thumbnail] + content_parts[1:]
-            # Join parts back with \n
-            final_content = '\n'.join(new_content)
-            
-            output_file.write(final_content + "\n\n")
-    
+        if CONTENT_MODE == "async":
+            print(f"Async mode: up to {CONTENT_CONCURRENCY} topics at a time")
+            asyncio.run(write_contents_async(subjects, output_file))
+        elif CONTENT_MODE == "batch":
+            print(f"Batch mode: job files and state in {llm_batch.BATCH_DIR}")
+            for subject, content in zip(subjects, generate_contents_batch(subjects)):
+                output_file.write(format_subject_content(subject, content) + "\n\n")
+        else:
+            for subject in subjects:
+                print(f"\n--- Processing topic: {subject} ---")
+                content = generate_content_for_subject(subject)
+                output_file.write(format_subject_content(subject, content) + "\n\n")
+    
+    llm_cache.print_stats()
+    print_run_stats()
     print(f"\nContent generation completed!")
     print(f"All content saved to: {CONTENT_FILE}")
 
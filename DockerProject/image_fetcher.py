@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Concurrent image search and download for image_processor.
+
+All keywords of a video are fetched by a bounded thread pool instead of one
+GoogleImageCrawler run after another. Every request goes through one pooled
+keep-alive requests.Session, and a per-host semaphore caps how many requests
+are in flight to the same host (fewer for the search host, which is the one
+that throttles), so the pool does not get us rate limited. Image bodies are
+streamed and refused past IMAGE_MAX_BYTES before PIL ever decodes them.
+
+The search backend is IMAGE_SEARCH_URL; point it at mock_image_server.py to
+run without network:
+    python mock_image_server.py &
+    IMAGE_SEARCH_URL=http://127.0.0.1:8090/search python image_fetcher.py "black hole" "Moon surface"
+"""
+import io
+import os
+import re
+import sys
+import time
+import threading
+import contextlib
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from PIL import Image
+
+# Config
+SEARCH_URL = os.getenv("IMAGE_SEARCH_URL", "https://www.google.com/search")
+FETCH_WORKERS = int(os.getenv("IMAGE_FETCH_WORKERS", "8"))  # Số keyword tải đồng thời
+PER_HOST_LIMIT = int(os.getenv("IMAGE_PER_HOST_LIMIT", "4"))  # Request đồng thời tối đa tới 1 host ảnh
+SEARCH_HOST_LIMIT = int(os.getenv("IMAGE_SEARCH_HOST_LIMIT", "2"))  # Request đồng thời tối đa tới search host
+CANDIDATES = 3  # Số ảnh tải cho mỗi keyword, giữ ảnh lớn nhất hợp lệ
+MAX_IMAGE_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))  # Bỏ qua ảnh lớn hơn (mặc định 10 MB)
+MAX_ATTEMPTS = 3  # Cho 429/503 của 1 request
+TIMEOUT = (5, 20)
+USER_AGENT = ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+              "(KHTML, like Gecko) Chrome/120.0 Safari/537.36")
+
+# Image URLs in the search page scripts (same pattern as icrawler's GoogleParser)
+SCRIPT_BLOCK = re.compile(r"<script[^>]*>(.*?)</script>", re.DOTALL | re.IGNORECASE)
+IMAGE_URL = re.compile(r"http[^\[\"'\s]*?\.(?:jpg|jpeg|png|bmp)", re.IGNORECASE)
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+_host_lock = threading.Lock()
+
+def get_session():
+    """One pooled keep-alive session shared by every worker"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers["User-Agent"] = USER_AGENT
+            adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=max(FETCH_WORKERS, PER_HOST_LIMIT))
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+    return _session
+
+@contextlib.contextmanager
+def host_slot(url):
+    """Hold one of the concurrency slots of url's host"""
+    host = urlsplit(url).netloc
+    with _host_lock:
+        if host not in _host_slots:
+            limit = SEARCH_HOST_LIMIT if host == urlsplit(SEARCH_URL).netloc else PER_HOST_LIMIT
+            _host_slots[host] = threading.BoundedSemaphore(max(1, limit))
+        slot = _host_slots[host]
+    with slot:
+        yield
+
+def http_get(url, params=None, max_bytes=None):
+    """GET within the host's limit; 429/503 are retried after Retry-After (the slot is released meanwhile).
+    
+    Returns the response, or with max_bytes the body as bytes (see read_limited).
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        with host_slot(url):
+            response = get_session().get(url, params=params, timeout=TIMEOUT, stream=max_bytes is not None)
+            if response.status_code not in (429, 503) or attempt == MAX_ATTEMPTS - 1:
+                response.raise_for_status()
+                # Đọc body trong slot: kết nối vẫn đang được dùng
+                return read_limited(response, max_bytes) if max_bytes is not None else response
+            response.close()
+        try:
+            delay = float(response.headers.get("Retry-After", 2 ** attempt))
+        except ValueError:
+            delay = 2 ** attempt
+        time.sleep(min(delay, 30))
+
+def read_limited(response, max_bytes):
+    """Body of a streamed response, ValueError if Content-Length or the data read exceeds max_bytes"""
+    with response:
+        length = response.headers.get("Content-Length", "")
+        if length.isdigit() and int(length) > max_bytes:
+            raise ValueError(f"{length} bytes > limit of {max_bytes}")
+        data = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            data += chunk
+            # Content-Length có thể thiếu hoặc sai
+            if len(data) > max_bytes:
+                raise ValueError(f"more than {max_bytes} bytes")
+        return bytes(data)
+
+def parse_search_page(html):
+    """Image URLs of the first script block that contains any"""
+    for block in SCRIPT_BLOCK.findall(html):
+        urls = IMAGE_URL.findall(block)
+        if urls:
+            # URL trong script bị escape (\u003d, \/)
+            return [url.replace("\\/", "/").encode("utf-8").decode("unicode-escape") for url in urls]
+    return []
+
+def search_image_urls(keyword):
+    response = http_get(SEARCH_URL, params={"q": keyword, "tbm": "isch", "ijn": 0, "start": 0})
+    urls = []
+    for url in parse_search_page(response.text):
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+def fetch_image(keyword, save_path):
+    """Search keyword, download up to CANDIDATES images and save the largest valid one as JPEG"""
+    try:
+        urls = search_image_urls(keyword)
+    except requests.RequestException as e:
+        print(f"❌ Image search failed for {keyword}: {e}")
+        return False
+
+    best, best_size, valid = None, 0, 0
+    for url in urls:
+        if valid >= CANDIDATES:
+            break
+        try:
+            data = http_get(url, max_bytes=MAX_IMAGE_BYTES)
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception:
+            continue  # Link hỏng, quá lớn hoặc không phải ảnh, thử link tiếp theo
+        valid += 1
+        if len(data) > best_size:
+            best, best_size = image, len(data)
+
+    if best is None:
+        print(f"⚠️ No valid images found for keyword: {keyword}")
+        return False
+    best.convert("RGB").save(save_path, "JPEG", quality=90)
+    return True
+
+def fetch_images(jobs, workers=FETCH_WORKERS):
+    """Fetch [(index, keyword, save_path)] concurrently, return {index: success}"""
+    results = {}
+    started_at = time.time()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(fetch_image, keyword, save_path): (index, keyword, save_path)
+                   for index, keyword, save_path in jobs}
+        for future in as_completed(futures):
+            index, keyword, save_path = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                print(f"❌ Error downloading image for keyword {keyword}: {e}")
+                results[index] = False
+            if results[index]:
+                print(f"✅ Downloaded image: {save_path} ({keyword})")
+    print(f"📥 {sum(results.values())}/{len(jobs)} images in {time.time() - started_at:.1f}s "
+          f"({workers} workers, {PER_HOST_LIMIT} per host)")
+    return results
+
+def main():
+    """Main function: fetch the keywords given on the command line into ./fetched_images"""
+    keywords = sys.argv[1:]
+    if not keywords:
+        print(__doc__)
+        return False
+    os.makedirs("fetched_images", exist_ok=True)
+    jobs = [(i, keyword, os.path.join("fetched_images", f"output_{i}.jpg")) for i, keyword in enumerate(keywords)]
+    return any(fetch_images(jobs).values())
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
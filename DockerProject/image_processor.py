@@ -1,12 +1,19 @@
 #!/usr/bin/env python3
 import os
 import sys
+import json
 import shutil
-from openai import OpenAI
 from dotenv import load_dotenv
 from icrawler.builtin import GoogleImageCrawler
 from PIL import Image
 
+import llm_cache
+import llm_gateway
+import llm_telemetry
+import image_fetcher
+import image_store
+import keyword_extractor
+
 # Load environment variables
 load_dotenv()
 
@@ -15,7 +22,7 @@ api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY environment variable is required")
 
-client = OpenAI(api_key=api_key)
+client = llm_gateway.create_client(api_key)
 
 # Paths
 SCRIPT_FILE = "/app/temp/current_script.txt"
@@ -23,6 +30,53 @@ KEYWORDS_FILE = "/app/temp/keywords.txt"
 IMAGES_DIR = "/app/temp/my_images"
 AUDIO_DIR = "/app/temp/my_audio"  # To count audio files
 
+# Streaming audio mode: no WAV files, 1 image per script line
+STREAM_AUDIO = os.getenv("TTS_OUTPUT", "file") == "stream"
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+
+# Keywords: "batch" = 1 request cho cả video (JSON array), chỉ gọi từng dòng cho các mục thiếu; "line" = 1 request mỗi dòng;
+# "local" = keyword_extractor, không gọi LLM
+KEYWORD_MODE = os.getenv("KEYWORD_MODE", "batch")
+KEYWORD_FALLBACK = os.getenv("KEYWORD_FALLBACK", "local")  # local | words (3 từ đầu đoạn) khi LLM lỗi/quá chậm
+KEYWORD_LLM_TIMEOUT = float(os.getenv("KEYWORD_LLM_TIMEOUT", "60"))  # Giây, gồm cả retry của gateway
+KEYWORD_BATCH_SIZE = int(os.getenv("KEYWORD_BATCH_SIZE", "60"))  # Số đoạn tối đa mỗi request
+KEYWORD_MAX_CHARS = 80
+KEYWORD_BATCH_TEMPERATURE = 0  # Line mode không gửi temperature (mặc định của API), cache key dùng None
+
+# Images: "icrawler" = GoogleImageCrawler từng keyword một; "pool" = image_fetcher tải đồng thời nhiều keyword (opt-in)
+IMAGE_FETCH_MODE = os.getenv("IMAGE_FETCH_MODE", "icrawler")
+
+# Instructions and examples of the batch keyword prompt (line mode keeps its original prompt, so its cache entries stay valid)
+KEYWORD_GUIDE = """You are helping a YouTube video editor find the best possible illustration image for a narration.
+Given a paragraph from the video script, your task is to extract the most visually representative and specific concept from that paragraph.
+
+This concept should be used as a concise image search keyword. Focus on the most central visual idea in the paragraph — something that could be shown as a background or main visual to accompany the narration.
+
+Avoid abstract concepts, non-visual metaphors, or generic keywords. Instead, choose a specific, vivid subject that would return clear and relevant image results (e.g., "black hole in space", "supernova explosion", "neutron star collision", "Milky Way core", "falling man in sky", etc).
+
+---
+
+Examples:
+1. "In 1969, humanity set foot on the Moon for the first time."
+→ surface of the Moon
+
+2. "Armstrong's famous words as he stepped down were: 'This is one small step for a man, but one giant leap for mankind.'"
+→ Neil Armstrong on the Moon
+
+3. "Have you ever imagined falling from over 10,000 meters without a parachute and surviving?"
+→ man falling from sky
+
+4. "On January 26, 1972, Vesna Vulović, a Yugoslavian flight attendant, was on duty aboard JAT Flight 367 when the plane suddenly exploded mid-air."
+→ mid-air plane explosion
+
+5. "As you can see, this line of reasoning leads us to Zeno's second paradox, known as the Dichotomy Paradox."
+→ Dichotomy Paradox
+
+6. "Finally, we encounter the Arrow Paradox, which posits that a flying arrow is motionless at every instant in time."
+→ Arrow Paradox
+---
+"""
+
 def setup_directories():
     """Setup and clean directories"""
     # Clean images directory
@@ -36,9 +90,14 @@ def chunk_text_by_audio_count():
     # Count audio files to determine how many chunks we need
     audio_count = 0
     if os.path.exists(AUDIO_DIR):
-        audio_files = [f for f in os.listdir(AUDIO_DIR) if f.endswith('.wav')]
+        audio_files = [f for f in os.listdir(AUDIO_DIR) if f.endswith(AUDIO_EXTENSIONS)]
         audio_count = len(audio_files)
     
+    if audio_count == 0 and STREAM_AUDIO:
+        print("🎧 Streaming audio mode, using every script line")
+        with open(SCRIPT_FILE, "r", encoding="utf-8") as file:
+            return [line.strip() for line in file.readlines() if line.strip()]
+    
     if audio_count == 0:
         print("⚠️ No audio files found, reading lines directly from script")
         # Fallback: read lines directly from script file
@@ -65,8 +124,8 @@ def chunk_text_by_audio_count():
     print(f"📝 Using {len(result_lines)} lines for image generation")
     return result_lines
 
-def generate_keyword_for_text(text, index):
-    """Generate keyword for a text chunk using OpenAI"""
+def generate_keyword_for_text(text, index, extractor=None):
+    """Generate keyword for a text chunk using OpenAI, or with extractor if the call fails"""
     print(f"🔍 Generating keyword for chunk {index+1}...")
     
     prompt = f"""
@@ -107,20 +166,140 @@ def generate_keyword_for_text(text, index):
     """
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        keyword = response.choices[0].message.content.strip().replace('"', '')
+        messages = [{"role": "user", "content": prompt}]
+        subject = os.getenv("VIDEO_TITLE")
+        
+        def create():
+            return llm_telemetry.streamed_completion(client.with_options(timeout=KEYWORD_LLM_TIMEOUT), "keyword", subject,
+                                                     model="gpt-4o-mini", messages=messages)
+        
+        keyword = llm_cache.cached_completion(
+            create, "gpt-4o-mini", messages,
+            on_hit=lambda: llm_telemetry.record_cache_hit("keyword", subject, "gpt-4o-mini")
+        ).strip().replace('"', '')
         print(f"✅ Generated keyword: {keyword}")
         return keyword
         
     except Exception as e:
         print(f"❌ Error generating keyword: {e}")
-        # Return a generic keyword based on text
-        words = text.split()[:3]
-        return ' '.join(words) if words else "generic concept"
+        keyword = fallback_keyword(text, extractor)
+        print(f"🔤 Fallback keyword: {keyword}")
+        return keyword
+
+def fallback_keyword(text, extractor=None):
+    """Keyword without the LLM: extractor (KEYWORD_FALLBACK=local) or the first three words"""
+    if extractor is not None:
+        return extractor.extract(text)
+    # Return a generic keyword based on text
+    words = text.split()[:3]
+    return ' '.join(words) if words else "generic concept"
+
+def parse_keyword_array(answer, count):
+    """{index: keyword} for every valid entry of a JSON array answer.
+    
+    Accepts [{"index": i, "keyword": "..."}] or a plain list of strings with
+    exactly count items. Entries that are missing, out of range, duplicated or
+    not a short phrase are left out so the caller can retry them one by one.
+    """
+    text = answer.strip()
+    start, end = text.find("["), text.rfind("]")
+    if start < 0 or end < start:
+        return {}
+    try:
+        items = json.loads(text[start:end + 1])
+    except ValueError:
+        return {}
+    if not isinstance(items, list):
+        return {}
+    
+    if all(isinstance(item, str) for item in items):
+        # Mảng chuỗi thuần: chỉ tin được thứ tự khi đủ số lượng
+        if len(items) != count:
+            return {}
+        items = [{"index": i, "keyword": item} for i, item in enumerate(items)]
+    
+    keywords = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        index, keyword = item.get("index"), item.get("keyword")
+        if not isinstance(index, int) or not 0 <= index < count or index in keywords:
+            continue
+        if not isinstance(keyword, str):
+            continue
+        keyword = keyword.strip().replace('"', '')
+        if keyword and len(keyword) <= KEYWORD_MAX_CHARS and "\n" not in keyword:
+            keywords[index] = keyword
+    return keywords
+
+def generate_keywords_batch(texts, extractor=None):
+    """Keywords for all texts with one LLM call per KEYWORD_BATCH_SIZE paragraphs.
+    
+    Returns {index: keyword} for the entries the model answered validly. When
+    the call itself fails (rate limit, timeout) the whole group gets fallback
+    keywords right away instead of one LLM call per paragraph, which would
+    most likely fail the same way.
+    """
+    subject = os.getenv("VIDEO_TITLE")
+    keywords = {}
+    for offset in range(0, len(texts), KEYWORD_BATCH_SIZE):
+        group = texts[offset:offset + KEYWORD_BATCH_SIZE]
+        paragraphs = "\n\n".join(f"[{i}] {text}" for i, text in enumerate(group))
+        prompt = f"""{KEYWORD_GUIDE}
+Now, for EACH of the following {len(group)} numbered paragraphs from a video script, suggest the best possible image keyword to illustrate it:
+
+{paragraphs}
+
+Return only a JSON array with one object per paragraph, in order, like:
+[{{"index": 0, "keyword": "surface of the Moon"}}, {{"index": 1, "keyword": "Neil Armstrong on the Moon"}}]
+No explanation, no markdown.
+"""
+        messages = [{"role": "user", "content": prompt}]
+        print(f"🔍 Generating keywords for chunks {offset + 1}-{offset + len(group)} in one request...")
+        
+        def create():
+            return llm_telemetry.streamed_completion(client.with_options(timeout=KEYWORD_LLM_TIMEOUT), "keyword_batch", subject,
+                                                     model="gpt-4o-mini", messages=messages, temperature=KEYWORD_BATCH_TEMPERATURE)
+        
+        try:
+            answer = llm_cache.cached_completion(
+                create, "gpt-4o-mini", messages, KEYWORD_BATCH_TEMPERATURE,
+                on_hit=lambda: llm_telemetry.record_cache_hit("keyword_batch", subject, "gpt-4o-mini")
+            )
+        except Exception as e:
+            print(f"❌ Error generating keywords: {e}, using {KEYWORD_FALLBACK} keywords for chunks {offset + 1}-{offset + len(group)}")
+            keywords.update({offset + i: fallback_keyword(text, extractor) for i, text in enumerate(group)})
+            continue
+        parsed = parse_keyword_array(answer, len(group))
+        if len(parsed) < len(group):
+            print(f"⚠️ Batch answer had {len(parsed)}/{len(group)} valid keywords")
+        keywords.update({offset + i: keyword for i, keyword in parsed.items()})
+    return keywords
+
+def generate_keywords(texts, mode=KEYWORD_MODE):
+    """One keyword per text.
+    
+    batch: one request per video, per-line calls only for entries missing
+    from its answer (fallback keywords if the request itself failed);
+    line: one request per text; local: keyword_extractor only. With
+    KEYWORD_FALLBACK=local a failed LLM call is answered by keyword_extractor.
+    """
+    extractor = None
+    if mode == "local" or KEYWORD_FALLBACK == "local":
+        # IDF trên toàn bộ script của video
+        extractor = keyword_extractor.KeywordExtractor(texts)
+    if mode == "local":
+        keywords = [extractor.extract(text) for text in texts]
+        print(f"🔤 Local keywords: {len(keywords)}")
+        return keywords
+    
+    keywords = generate_keywords_batch(texts, extractor) if mode == "batch" else {}
+    if mode == "batch":
+        print(f"✅ Batch keywords: {len(keywords)}/{len(texts)}")
+    for i, text in enumerate(texts):
+        if i not in keywords:
+            keywords[i] = generate_keyword_for_text(text, i, extractor)
+    return [keywords[i] for i in range(len(texts))]
 
 def download_image_with_icrawler(keyword, save_path, index):
     """Download image using icrawler"""
@@ -236,23 +415,34 @@ def main():
     text_chunks = chunk_text_by_audio_count()
     print(f"📝 Created {len(text_chunks)} text chunks for image generation")
     
-    # Generate keywords and download images
-    keywords = []
+    # Generate keywords (one request for the whole video in batch mode), then download images
+    text_chunks = [text_chunk for text_chunk in text_chunks if text_chunk.strip()]
+    keywords = generate_keywords(text_chunks)
     success_count = 0
     
+    image_paths = [os.path.join(IMAGES_DIR, f"output_{i}.jpg") for i in range(len(text_chunks))]
+    
+    # Keyword đã tải ở video/lần chạy trước: lấy từ image store
+    downloaded = {i: True for i, (keyword, image_path) in enumerate(zip(keywords, image_paths))
+                  if image_store.restore(keyword, image_path)}
+    missing = [(i, keywords[i], image_paths[i]) for i in range(len(keywords)) if i not in downloaded]
+    print(f"🗂️ {len(downloaded)} images from the image store, {len(missing)} to download")
+    
+    if not missing:
+        fetched = {}
+    elif IMAGE_FETCH_MODE == "pool":
+        # Tải đồng thời mọi keyword còn thiếu
+        fetched = image_fetcher.fetch_images(missing)
+    else:
+        fetched = {i: download_image_with_icrawler(keyword, image_path, i) for i, keyword, image_path in missing}
+    for i, keyword, image_path in missing:
+        if fetched.get(i):
+            image_store.add(keyword, image_path)
+    downloaded.update(fetched)
+    
     for i, text_chunk in enumerate(text_chunks):
-        if not text_chunk.strip():
-            continue
-            
-        # Generate keyword
-        keyword = generate_keyword_for_text(text_chunk, i)
-        keywords.append(keyword)
-        
-        # Download image
-        image_path = os.path.join(IMAGES_DIR, f"output_{i}.jpg")
-        
-        # Try to download image
-        success = download_image_with_icrawler(keyword, image_path, i)
+        image_path = image_paths[i]
+        success = downloaded.get(i, False)
         
         # Create placeholder if download failed
         if not success:
@@ -265,6 +455,8 @@ def main():
     # Save keywords to file
     with open(KEYWORDS_FILE, "w", encoding="utf-8") as f:
         f.write("\n".join(keywords))
+    llm_cache.print_stats()
+    image_store.print_stats()
     
     print(f"\n✅ Image processing completed!")
     print(f"📊 Successfully processed {success_count}/{len(text_chunks)} images")
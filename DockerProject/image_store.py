@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Persistent image store shared by every video and rerun.
+
+image_processor wipes my_images for each video; downloaded images are kept
+here instead, indexed by normalized keyword, so a keyword that comes back
+("Britney Spears on stage" in three videos) is served from disk without a
+search. Every stored image has a 64-bit perceptual hash (dHash); a download
+within STORE_DUPLICATE_DISTANCE bits of an image already stored is not saved
+again, its keyword just points at the existing file. Over IMAGE_STORE_MAX_MB
+the least recently used images are evicted.
+
+Usage:
+    python image_store.py           print store size
+    python image_store.py --clear   empty the store
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import threading
+
+from PIL import Image
+
+# Config
+STORE_DIR = os.getenv("IMAGE_STORE_DIR", "/app/output/.cache/images")
+STORE_ENABLED = os.getenv("IMAGE_STORE_ENABLED", "1") == "1"
+STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_MB", "1024")) * 1024 * 1024
+STORE_DUPLICATE_DISTANCE = int(os.getenv("IMAGE_STORE_DUPLICATE_DISTANCE", "6"))  # Số bit khác nhau tối đa của 2 ảnh "giống nhau"
+HASH_SIZE = 8  # dHash 8x8 = 64 bit
+
+# Counters for the current run
+_stats = {"hits": 0, "misses": 0, "stores": 0, "duplicates": 0, "evictions": 0}
+_connection = None
+_hashes = None  # {hash int: hash hex} của mọi ảnh trong store, load 1 lần
+_lock = threading.Lock()
+
+def normalize_keyword(keyword):
+    """Lowercase, no punctuation, single spaces: 'Britney Spears, on stage!' -> 'britney spears on stage'"""
+    return " ".join(re.sub(r"[^\w\s]", " ", keyword.lower()).split())
+
+def perceptual_hash(image):
+    """64-bit difference hash: is each pixel of a 9x8 grayscale thumbnail brighter than its right neighbour"""
+    pixels = list(image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+def _connect():
+    """Open the index once per process"""
+    global _connection, _hashes
+    if _connection is None:
+        os.makedirs(STORE_DIR, exist_ok=True)
+        _connection = sqlite3.connect(os.path.join(STORE_DIR, "index.sqlite3"), timeout=30, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        _connection.execute("""
+            CREATE TABLE IF NOT EXISTS keywords (
+                keyword TEXT PRIMARY KEY,
+                hash TEXT NOT NULL
+            )
+        """)
+        _connection.commit()
+        _hashes = {int(row[0], 16): row[0] for row in _connection.execute("SELECT hash FROM images")}
+    return _connection
+
+def image_path(image_hash):
+    return os.path.join(STORE_DIR, image_hash[:2], f"{image_hash}.jpg")
+
+def _drop(connection, image_hash):
+    """Remove an image, its file and every keyword pointing at it"""
+    connection.execute("DELETE FROM images WHERE hash = ?", (image_hash,))
+    connection.execute("DELETE FROM keywords WHERE hash = ?", (image_hash,))
+    _hashes.pop(int(image_hash, 16), None)
+    try:
+        os.remove(image_path(image_hash))
+    except OSError:
+        pass
+
+def restore(keyword, save_path):
+    """Copy the stored image for keyword to save_path; False on a miss"""
+    if not STORE_ENABLED:
+        return False
+    try:
+        with _lock:
+            connection = _connect()
+            row = connection.execute("SELECT hash FROM keywords WHERE keyword = ?", (normalize_keyword(keyword),)).fetchone()
+            if row:
+                if os.path.exists(image_path(row[0])):
+                    shutil.copyfile(image_path(row[0]), save_path)
+                    connection.execute("UPDATE images SET last_used = ? WHERE hash = ?", (time.time(), row[0]))
+                    connection.commit()
+                    _stats["hits"] += 1
+                    return True
+                # File bị xóa ngoài store: bỏ entry
+                _drop(connection, row[0])
+                connection.commit()
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Image store read failed: {e}")
+    _stats["misses"] += 1
+    return False
+
+def add(keyword, source_path):
+    """Store a downloaded image under keyword, or point keyword at a near-duplicate already stored"""
+    if not STORE_ENABLED:
+        return
+    try:
+        with Image.open(source_path) as image:
+            new_hash = perceptual_hash(image)
+        now = time.time()
+        with _lock:
+            connection = _connect()
+            duplicate = min(_hashes, key=lambda stored: hamming_distance(stored, new_hash), default=None)
+            if duplicate is not None and hamming_distance(duplicate, new_hash) <= STORE_DUPLICATE_DISTANCE:
+                image_hash = _hashes[duplicate]
+                connection.execute("UPDATE images SET last_used = ? WHERE hash = ?", (now, image_hash))
+                _stats["duplicates"] += 1
+            else:
+                image_hash = f"{new_hash:016x}"
+                os.makedirs(os.path.dirname(image_path(image_hash)), exist_ok=True)
+                shutil.copyfile(source_path, image_path(image_hash))
+                connection.execute(
+                    "INSERT OR REPLACE INTO images (hash, size, created_at, last_used) VALUES (?, ?, ?, ?)",
+                    (image_hash, os.path.getsize(source_path), now, now)
+                )
+                _hashes[new_hash] = image_hash
+                _stats["stores"] += 1
+            connection.execute("INSERT OR REPLACE INTO keywords (keyword, hash) VALUES (?, ?)",
+                               (normalize_keyword(keyword), image_hash))
+            connection.commit()
+            _evict(connection, STORE_MAX_BYTES)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Image store write failed: {e}")
+
+def _evict(connection, max_bytes):
+    """Drop the least recently used images until the store fits in max_bytes"""
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+    if total <= max_bytes:
+        return
+    for image_hash, size in connection.execute("SELECT hash, size FROM images ORDER BY last_used").fetchall():
+        if total <= max_bytes:
+            break
+        _drop(connection, image_hash)
+        total -= size
+        _stats["evictions"] += 1
+    connection.commit()
+
+def get_stats():
+    return dict(_stats)
+
+def print_stats():
+    """Print hit/miss counters for the current run"""
+    if not STORE_ENABLED:
+        return
+    lookups = _stats["hits"] + _stats["misses"]
+    hit_rate = _stats["hits"] / lookups * 100 if lookups else 0.0
+    print(f"🗂️ Image store: {_stats['hits']} hits, {_stats['misses']} misses ({hit_rate:.1f}% hit rate), "
+          f"{_stats['stores']} stored, {_stats['duplicates']} near-duplicates collapsed, {_stats['evictions']} evicted")
+
+def main():
+    """Main function: print store size, `--clear` empties it"""
+    if not os.path.exists(os.path.join(STORE_DIR, "index.sqlite3")):
+        print(f"🗂️ Image store {STORE_DIR}: empty")
+        return True
+
+    with _lock:
+        connection = _connect()
+        if "--clear" in sys.argv[1:]:
+            for image_hash in list(_hashes.values()):
+                _drop(connection, image_hash)
+            connection.commit()
+            connection.execute("VACUUM")
+            print(f"🧹 Cleared image store: {STORE_DIR}")
+            return True
+        count, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+        keywords = connection.execute("SELECT COUNT(*) FROM keywords").fetchone()[0]
+
+    print(f"🗂️ Image store {STORE_DIR}: {count} images for {keywords} keywords, "
+          f"{total / (1024 * 1024):.1f}/{STORE_MAX_BYTES / (1024 * 1024):.0f} MB")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Local image keyword extraction, no network and a few milliseconds per paragraph.
+
+Candidates are noun phrases of the paragraph (spaCy noun chunks when the
+en_core_web_sm model is installed - it is in the image for Kokoro's G2P -,
+otherwise runs of words between stopwords). Each candidate is scored with
+TF-IDF against the whole script, so words that every paragraph repeats (the
+video's topic) count less than what is specific to this paragraph.
+
+Usage:
+    python keyword_extractor.py [script_file]   print one keyword per line
+"""
+import os
+import re
+import sys
+import math
+from collections import Counter
+
+# Config
+SPACY_MODEL = "en_core_web_sm"
+MAX_PHRASE_WORDS = 4
+PROPER_NOUN_BOOST = 1.5  # Tên riêng (viết hoa giữa câu) thường cho ảnh cụ thể hơn
+
+WORD = re.compile(r"[A-Za-z][A-Za-z0-9'\-]*")
+STOPWORDS = set("""
+a about above after again against all almost also although always am among an and another any are around as at
+be became because become been before being below between both but by can could did do does doing done down during
+each either enough even ever every few for from further had has have having he her here hers herself him himself his
+how however i if in into is it its itself just last least less like made make many may me might more most much must
+my myself near never next no nor not now of off often on once one only onto or other others our ours ourselves out
+over own per perhaps quite rather really same several she should since so some something still such than that the
+their theirs them themselves then there these they this those though through thus to too toward under until up upon
+us very was way we well were what when where whether which while who whom whose why will with within without would
+yet you your yours yourself yourselves
+imagine see seen know known think thought call called say said tell told let lets get got go goes going went come came
+take took show shows shown find found become becomes seem seems keep kept begin began want wanted look looks looked
+first second third new old many much great little big small long whole simply actually truly indeed even
+""".split())
+LEADING_SKIP_POS = {"DET", "PRON", "PART", "CCONJ", "ADP", "NUM", "PUNCT"}
+
+_nlp = None
+
+def load_spacy():
+    """spaCy pipeline for noun chunks, False when spaCy or the model is not installed"""
+    global _nlp
+    if _nlp is None:
+        try:
+            import spacy
+            _nlp = spacy.load(SPACY_MODEL, disable=["ner", "lemmatizer"])
+        except Exception:
+            _nlp = False
+    return _nlp
+
+def tokenize(text):
+    return [word.lower().strip("'-") for word in WORD.findall(text)]
+
+def spacy_candidates(doc):
+    """Noun chunks without leading determiners/pronouns, at most MAX_PHRASE_WORDS words"""
+    for chunk in doc.noun_chunks:
+        tokens = list(chunk)
+        while tokens and (tokens[0].pos_ in LEADING_SKIP_POS or tokens[0].lower_ in STOPWORDS):
+            tokens.pop(0)
+        if not tokens or tokens[-1].pos_ == "PRON":
+            continue
+        tokens = tokens[-MAX_PHRASE_WORDS:]  # Giữ danh từ chính ở cuối
+        proper = any(token.pos_ == "PROPN" for token in tokens)
+        yield " ".join(token.text for token in tokens), proper
+
+def regex_candidates(text):
+    """Runs of non-stopwords inside a sentence clause, at most MAX_PHRASE_WORDS words"""
+    for clause in re.split(r"[.,;:!?()\"“”]+", text):
+        run = []
+        for position, word in enumerate(WORD.findall(clause) + [""]):
+            # Động từ quá khứ viết thường (landed, imagined) cũng ngắt cụm
+            verb = word.islower() and len(word) > 4 and word.endswith("ed")
+            if word and word.lower() not in STOPWORDS and len(word) > 1 and not verb:
+                run.append((position, word))
+                continue
+            if run:
+                words = [w for _, w in run][-MAX_PHRASE_WORDS:]
+                proper = any(w[0].isupper() and p > 0 for p, w in run)
+                yield " ".join(words), proper
+            run = []
+
+class KeywordExtractor:
+    """TF-IDF noun phrase scorer fitted on all paragraphs of one script"""
+
+    def __init__(self, texts):
+        self.nlp = load_spacy()
+        self.document_count = len(texts)
+        document_frequency = Counter()
+        for text in texts:
+            document_frequency.update(set(tokenize(text)))
+        self.idf = {word: math.log((1 + self.document_count) / (1 + count)) + 1
+                    for word, count in document_frequency.items()}
+
+    def candidates(self, text):
+        if self.nlp:
+            return list(spacy_candidates(self.nlp(text)))
+        return list(regex_candidates(text))
+
+    def score(self, phrase, proper, term_frequency, total):
+        words = {word for word in tokenize(phrase) if word not in STOPWORDS}
+        if not words:
+            return 0.0
+        score = sum(term_frequency[word] / total * self.idf.get(word, math.log(1 + self.document_count) + 1)
+                    for word in words)
+        return score * (PROPER_NOUN_BOOST if proper else 1.0)
+
+    def extract(self, text):
+        """Best scoring phrase of text; the first three words if it has no candidate"""
+        tokens = tokenize(text)
+        term_frequency = Counter(tokens)
+        best, best_score = None, 0.0
+        for phrase, proper in self.candidates(text):
+            score = self.score(phrase, proper, term_frequency, max(1, len(tokens)))
+            if score > best_score:
+                best, best_score = phrase, score
+        if best is None:
+            words = text.split()[:3]
+            return ' '.join(words) if words else "generic concept"
+        return best.replace('"', '')
+
+def extract_keywords(texts):
+    """One keyword per text, scored against all of texts"""
+    extractor = KeywordExtractor(texts)
+    return [extractor.extract(text) for text in texts]
+
+def main():
+    """Main function"""
+    script_file = sys.argv[1] if len(sys.argv) > 1 else "/app/temp/current_script.txt"
+    if not os.path.exists(script_file):
+        print(f"❌ Script file not found: {script_file}")
+        return False
+    with open(script_file, "r", encoding="utf-8") as file:
+        texts = [line.strip() for line in file if line.strip()]
+    print(f"🔤 Noun phrases from {'spaCy ' + SPACY_MODEL if load_spacy() else 'stopword chunking'}")
+    for i, keyword in enumerate(extract_keywords(texts)):
+        print(f"{i + 1}. {keyword}")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
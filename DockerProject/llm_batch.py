@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Helpers for the OpenAI Batch API: write a JSONL job file, submit it, wait
+for it and read the answers back.
+
+State is plain JSON written atomically, so a run that is stopped while a batch
+is in flight picks the same batch up again instead of submitting a new one.
+"""
+import os
+import glob
+import json
+import time
+import tempfile
+
+# Config
+BATCH_DIR = os.getenv("LLM_BATCH_DIR", "/app/output/.cache/batch")
+POLL_SECONDS = float(os.getenv("LLM_BATCH_POLL_SECONDS", "30"))
+COMPLETION_WINDOW = "24h"
+ENDPOINT = "/v1/chat/completions"
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+def load_state(path):
+    """Saved state dict, or None if there is none"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_state(path, state):
+    """Write state via a temp file + rename so a crash never leaves it half written"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+def job_file_path(round_number):
+    return os.path.join(BATCH_DIR, f"round_{round_number}.jsonl")
+
+def remove_run_files(state_path):
+    """Delete the state file and every round's job file once the run is done"""
+    for path in [state_path] + glob.glob(job_file_path("*")):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def write_job_file(path, jobs):
+    """One request per line: {custom_id, method, url, body}"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in jobs.items():
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body}, ensure_ascii=False) + "\n")
+
+def submit_job_file(client, path):
+    """Upload the job file and create the batch, return the batch id"""
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT, completion_window=COMPLETION_WINDOW)
+    return batch.id
+
+def wait_for_batch(client, batch_id):
+    """Poll until the batch reaches a final status, return the batch object"""
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status in FINAL_STATUSES:
+            return batch
+        counts = batch.request_counts
+        if counts is not None:
+            print(f"⏳ Batch {batch_id}: {batch.status}, {counts.completed}/{counts.total} done")
+        time.sleep(POLL_SECONDS)
+
+def read_outputs(client, batch):
+    """{custom_id: response} from the output file, response = {status_code, body}"""
+    outputs = {}
+    if not batch.output_file_id:
+        return outputs
+    for line in client.files.content(batch.output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        outputs[record["custom_id"]] = record.get("response") or {}
+    return outputs
+
+def read_results(outputs):
+    """{custom_id: answer text} for every request in read_outputs() that succeeded"""
+    return {
+        custom_id: response["body"]["choices"][0]["message"]["content"]
+        for custom_id, response in outputs.items()
+        if response.get("status_code") == 200
+    }
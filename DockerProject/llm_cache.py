@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Persistent SQLite cache for chat completion responses.
+
+Responses are keyed by the hash of everything sent to the model (model,
+temperature, messages, max_tokens), so a rerun after a failure reuses every
+call that already succeeded instead of paying for it again.
+
+Modes (LLM_CACHE_MODE):
+    on      reuse entries younger than LLM_CACHE_TTL_DAYS, store new ones (default)
+    replay  answer only from the cache, ignoring the TTL; a miss is an error, so
+            a rerun is fully deterministic and never reaches the API
+    off     no cache
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+
+# Config
+CACHE_PATH = os.getenv("LLM_CACHE_PATH", "/app/output/.cache/llm_cache.sqlite3")
+CACHE_MODE = os.getenv("LLM_CACHE_MODE", "on")  # on | replay | off
+CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_DAYS", "30")) * 24 * 3600
+CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_MB", "256")) * 1024 * 1024
+
+# Counters for the current run
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_connection = None
+_lock = threading.Lock()
+
+def cache_key(model, temperature, messages, max_tokens):
+    """Hash of everything that changes the model's answer"""
+    payload = json.dumps([model, temperature, messages, max_tokens], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _connect():
+    """Open the database once per process"""
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        # Nhiều process (generate_content, image_processor) có thể mở cùng lúc
+        _connection = sqlite3.connect(CACHE_PATH, timeout=30, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        _connection.commit()
+    return _connection
+
+def lookup(key):
+    """Return the cached response for key, or None on a miss (raises on a miss in replay mode)"""
+    if CACHE_MODE == "off":
+        return None
+    try:
+        with _lock:
+            connection = _connect()
+            row = connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and (CACHE_MODE == "replay" or time.time() - row[1] <= CACHE_TTL_SECONDS):
+                connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                connection.commit()
+                _stats["hits"] += 1
+                return row[0]
+    except sqlite3.Error as e:
+        print(f"⚠️ LLM cache read failed: {e}")
+    _stats["misses"] += 1
+    if CACHE_MODE == "replay":
+        raise RuntimeError(f"LLM cache miss in replay mode (key {key[:12]})")
+    return None
+
+def store(key, model, response):
+    """Save a response, then evict least recently used rows if over the size limit"""
+    if CACHE_MODE != "on" or response is None:
+        return
+    now = time.time()
+    try:
+        with _lock:
+            connection = _connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now)
+            )
+            connection.commit()
+            _stats["stores"] += 1
+            _evict(connection, CACHE_MAX_BYTES)
+    except sqlite3.Error as e:
+        print(f"⚠️ LLM cache write failed: {e}")
+
+def _evict(connection, max_bytes):
+    """Drop expired rows, then the least recently used ones until the cache fits in max_bytes"""
+    cursor = connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - CACHE_TTL_SECONDS,))
+    evicted = cursor.rowcount
+    total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    if total > max_bytes:
+        for key, size in connection.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if total <= max_bytes:
+                break
+            connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+    connection.commit()
+    _stats["evictions"] += evicted
+
+def cached_completion(create, model, messages, temperature=None, max_tokens=None, on_hit=None):
+    """Return the cached answer, or call create() (-> text) and cache its result.
+
+    on_hit() is called when the answer came from the cache (e.g. for telemetry).
+    """
+    key = cache_key(model, temperature, messages, max_tokens)
+    response = lookup(key)
+    if response is None:
+        response = create()
+        store(key, model, response)
+    elif on_hit:
+        on_hit()
+    return response
+
+async def cached_completion_async(create, model, messages, temperature=None, max_tokens=None, on_hit=None):
+    """Same as cached_completion, create() returns an awaitable"""
+    key = cache_key(model, temperature, messages, max_tokens)
+    # SQLite là blocking I/O (có thể chờ lock tới 30s), chạy ngoài event loop
+    response = await asyncio.to_thread(lookup, key)
+    if response is None:
+        response = await create()
+        await asyncio.to_thread(store, key, model, response)
+    elif on_hit:
+        on_hit()
+    return response
+
+def get_stats():
+    return dict(_stats)
+
+def print_stats():
+    """Print hit/miss counters for the current run"""
+    if CACHE_MODE == "off":
+        return
+    lookups = _stats["hits"] + _stats["misses"]
+    hit_rate = _stats["hits"] / lookups * 100 if lookups else 0.0
+    print(f"💾 LLM cache ({CACHE_MODE}): {_stats['hits']} hits, {_stats['misses']} misses "
+          f"({hit_rate:.1f}% hit rate), {_stats['evictions']} evicted")
+
+def main():
+    """Main function: print cache size, `--clear` empties it"""
+    if not os.path.exists(CACHE_PATH):
+        print(f"💾 LLM cache {CACHE_PATH}: empty")
+        return True
+
+    with _lock:
+        connection = _connect()
+        if "--clear" in sys.argv[1:]:
+            connection.execute("DELETE FROM responses")
+            connection.commit()
+            connection.execute("VACUUM")
+            print(f"🧹 Cleared LLM cache: {CACHE_PATH}")
+            return True
+        count, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+
+    print(f"💾 LLM cache {CACHE_PATH}: {count} responses, "
+          f"{total / (1024 * 1024):.1f}/{CACHE_MAX_BYTES / (1024 * 1024):.0f} MB")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
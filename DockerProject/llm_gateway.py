@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Local OpenAI API gateway shared by every stage of the pipeline.
+
+generate_content.py and image_processor.py (which runs once per video) send
+their requests here instead of opening their own TLS connections. The gateway
+keeps a keep-alive connection pool to the upstream API and limits how many
+requests are in flight with AIMD: the limit grows by ~1 per round trip while
+requests succeed and is halved on 429/5xx, and those are retried with backoff
+(Retry-After when the API sends one). Streaming responses are passed through
+chunk by chunk.
+
+Usage:
+    python llm_gateway.py            serve on LLM_GATEWAY_PORT
+    python llm_gateway.py --health   print gateway state
+"""
+import os
+import sys
+import json
+import time
+import random
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.request import urlopen
+
+import requests
+
+# Config
+GATEWAY_HOST = os.getenv("LLM_GATEWAY_HOST", "127.0.0.1")
+GATEWAY_PORT = int(os.getenv("LLM_GATEWAY_PORT", "50772"))
+GATEWAY_ENABLED = os.getenv("LLM_GATEWAY_ENABLED", "1") == "1"
+UPSTREAM_URL = os.getenv("LLM_GATEWAY_UPSTREAM", os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")).rstrip("/")
+INITIAL_CONCURRENCY = float(os.getenv("LLM_GATEWAY_CONCURRENCY", "8"))
+MIN_CONCURRENCY = 1
+MAX_CONCURRENCY = int(os.getenv("LLM_GATEWAY_MAX_CONCURRENCY", "64"))
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN = 1.0  # Giảm tối đa 1 lần mỗi giây, không sụp về 1 khi nhiều 429 về cùng lúc
+MAX_RETRIES = int(os.getenv("LLM_GATEWAY_MAX_RETRIES", "5"))
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+REQUEST_TIMEOUT = 600
+STARTUP_TIMEOUT = 15
+
+# Headers that belong to one hop, not to the request/response being forwarded
+HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+               "transfer-encoding", "upgrade", "content-length", "host"}
+
+class AimdLimiter:
+    """Concurrency limit with additive increase / multiplicative decrease"""
+
+    def __init__(self, initial=INITIAL_CONCURRENCY, minimum=MIN_CONCURRENCY, maximum=MAX_CONCURRENCY):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, overloaded):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                now = time.time()
+                if now - self.last_decrease >= DECREASE_COOLDOWN:
+                    self.limit = max(self.minimum, self.limit * DECREASE_FACTOR)
+                    self.last_decrease = now
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+# Gateway state (server side)
+_limiter = AimdLimiter()
+_session = None
+_stats = {"requests": 0, "retries": 0, "overloaded": 0, "failed": 0, "started_at": time.time()}
+
+def get_session():
+    """One pooled keep-alive session for all upstream requests"""
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY, max_retries=0)
+        _session.mount("https://", adapter)
+        _session.mount("http://", adapter)
+    return _session
+
+def backoff_seconds(attempt, retry_after=None):
+    """Retry-After if the API sent one, otherwise exponential backoff with jitter"""
+    try:
+        if retry_after is not None:
+            return min(BACKOFF_MAX, float(retry_after))
+    except ValueError:
+        pass
+    return min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    """Forward /v1/* to the upstream API"""
+    protocol_version = "HTTP/1.1"  # Keep-alive giữa các stage và gateway
+
+    def do_GET(self):
+        if self.path == "/health":
+            return self.send_json({"status": "ok", "upstream": UPSTREAM_URL, "limit": round(_limiter.limit, 2),
+                                   "in_flight": _limiter.in_flight, **_stats})
+        self.forward("GET")
+
+    def do_POST(self):
+        self.forward("POST")
+
+    def do_DELETE(self):
+        self.forward("DELETE")
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def forward(self, method):
+        if not self.path.startswith("/v1/"):
+            return self.send_json({"error": {"message": f"unknown path {self.path}"}}, 404)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        headers = {name: value for name, value in self.headers.items() if name.lower() not in HOP_HEADERS}
+        url = UPSTREAM_URL + self.path[len("/v1"):]
+        _stats["requests"] += 1
+
+        delay = 0
+        for attempt in range(MAX_RETRIES + 1):
+            if delay:
+                time.sleep(delay)
+            _limiter.acquire()
+            overloaded = False
+            try:
+                response = get_session().request(method, url, headers=headers, data=body,
+                                                  stream=True, timeout=(10, REQUEST_TIMEOUT))
+                overloaded = response.status_code == 429 or response.status_code >= 500
+                if overloaded:
+                    _stats["overloaded"] += 1
+                    if attempt < MAX_RETRIES:
+                        _stats["retries"] += 1
+                        delay = backoff_seconds(attempt, response.headers.get("Retry-After"))
+                        response.close()
+                        continue
+                self.relay(response, attempt)
+                return
+            except requests.RequestException as e:
+                overloaded = True
+                if attempt < MAX_RETRIES:
+                    _stats["retries"] += 1
+                    delay = backoff_seconds(attempt)
+                    continue
+                _stats["failed"] += 1
+                return self.send_json({"error": {"message": f"upstream unreachable: {e}"}}, 502)
+            finally:
+                _limiter.release(overloaded)
+
+    def relay(self, response, retries=0):
+        """Copy status, headers and body; bodies without a length (SSE) are sent chunked as they arrive"""
+        length = response.headers.get("Content-Length")
+        self.send_response(response.status_code)
+        for name, value in response.headers.items():
+            if name.lower() not in HOP_HEADERS:
+                self.send_header(name, value)
+        self.send_header("X-Gateway-Retries", str(retries))  # Cho llm_telemetry đếm retry
+        if length is not None:
+            self.send_header("Content-Length", length)
+        else:
+            self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            # raw stream: giữ nguyên content-encoding của upstream
+            for chunk in response.raw.stream(8192, decode_content=False):
+                if length is None:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+                self.wfile.flush()
+            if length is None:
+                self.wfile.write(b"0\r\n\r\n")
+        finally:
+            response.close()
+
+    def log_message(self, format, *args):
+        pass
+
+class GatewayServer(ThreadingHTTPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def gateway_url():
+    return f"http://{GATEWAY_HOST}:{GATEWAY_PORT}/v1"
+
+def health_check(timeout=1):
+    """Return gateway health dict, or None if it is not reachable"""
+    try:
+        with urlopen(f"http://{GATEWAY_HOST}:{GATEWAY_PORT}/health", timeout=timeout) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+def create_client(api_key, async_client=False):
+    """OpenAI client that goes through the gateway when it is running, directly otherwise"""
+    import openai
+    client_class = openai.AsyncOpenAI if async_client else openai.OpenAI
+    if GATEWAY_ENABLED and health_check() is not None:
+        # Gateway tự retry 429/5xx và điều chỉnh concurrency
+        return client_class(api_key=api_key, base_url=gateway_url(), max_retries=0)
+    return client_class(api_key=api_key)
+
+def start_gateway():
+    """Start the gateway in the background if it is not already running.
+
+    Returns the Popen handle of the started process, or None when a gateway was
+    already running, it is disabled, or it failed to start.
+    """
+    if not GATEWAY_ENABLED:
+        return None
+
+    if health_check() is not None:
+        print("✅ LLM gateway already running")
+        return None
+
+    print("🚀 Starting LLM gateway...")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "llm_gateway.py")
+    proc = subprocess.Popen([sys.executable, script])
+
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline and proc.poll() is None:
+        if health_check() is not None:
+            print(f"✅ LLM gateway on {gateway_url()} -> {UPSTREAM_URL}")
+            return proc
+        time.sleep(0.2)
+
+    print("⚠️ LLM gateway did not start, stages will call the API directly")
+    stop_gateway(proc)
+    return None
+
+def stop_gateway(proc):
+    """Stop a gateway process started by start_gateway"""
+    if proc is None or proc.poll() is not None:
+        return
+    health = health_check()
+    if health:
+        print(f"📊 LLM gateway: {health['requests']} requests, {health['retries']} retries, "
+              f"{health['overloaded']} 429/5xx, final concurrency limit {health['limit']}")
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    print("🛑 LLM gateway stopped")
+
+def serve():
+    """Run the gateway until the process is terminated"""
+    with GatewayServer((GATEWAY_HOST, GATEWAY_PORT), GatewayHandler) as server:
+        print(f"🌐 LLM gateway listening on {GATEWAY_HOST}:{GATEWAY_PORT}, upstream {UPSTREAM_URL}")
+        server.serve_forever()
+
+def main():
+    """Main function: `--health` prints gateway state, otherwise serve"""
+    if "--health" in sys.argv[1:]:
+        health = health_check()
+        print(json.dumps(health, indent=2) if health else "❌ LLM gateway not reachable")
+        return health is not None
+
+    serve()
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Per-call LLM telemetry: one JSONL record per chat completion.
+
+Every call is made as a stream (with usage reported in the last chunk) so
+time-to-first-token can be measured. Each record holds the step name, subject,
+model, prompt/completion tokens, TTFT, total latency and retry count (ours plus
+the LLM gateway's). Cache hits are recorded with cached=true, answers from
+the Batch API with batch=true (latency = the whole batch, no TTFT).
+
+Usage:
+    python llm_telemetry.py [telemetry_file]   percentiles per step
+    python llm_telemetry.py --since TS         only records from unix time TS on
+    python llm_telemetry.py --clear            start a new log
+"""
+import os
+import sys
+import json
+import time
+import random
+import threading
+
+import openai
+
+# Config
+TELEMETRY_FILE = os.getenv("LLM_TELEMETRY_FILE", "/app/output/llm_telemetry.jsonl")
+TELEMETRY_ENABLED = os.getenv("LLM_TELEMETRY_ENABLED", "1") == "1"
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+# Stream bị ngắt giữa chừng: SDK không bọc lỗi transport của httpx khi đọc từng chunk
+try:
+    import httpx
+    STREAM_ERRORS = (openai.APIError, httpx.HTTPError)
+except ImportError:
+    STREAM_ERRORS = (openai.APIError,)
+
+# Steps in pipeline order for the report
+STEP_ORDER = ["analysis", "structure", "details", "hooks", "script", "narration", "expand", "keyword_batch", "keyword"]
+
+_lock = threading.Lock()
+
+def record(step, subject, model, **fields):
+    """Append one record to the telemetry file"""
+    if not TELEMETRY_ENABLED:
+        return
+    entry = {"ts": round(time.time(), 3), "step": step, "subject": subject, "model": model, **fields}
+    try:
+        os.makedirs(os.path.dirname(TELEMETRY_FILE), exist_ok=True)
+        with _lock, open(TELEMETRY_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"⚠️ Cannot write LLM telemetry: {e}")
+
+def record_cache_hit(step, subject, model):
+    record(step, subject, model, cached=True)
+
+def record_batch_response(step, subject, model, response, latency, retries=0):
+    """One record for a Batch API request (response = {status_code, body} from llm_batch.read_outputs, None if missing)"""
+    if response is None:
+        response, error = {}, "BatchNoOutput"
+    elif response.get("status_code") != 200:
+        error = f"BatchStatus{response.get('status_code')}"
+    else:
+        error = None
+    usage = (response.get("body") or {}).get("usage") or {}
+    record(
+        step, subject, model,
+        prompt_tokens=usage.get("prompt_tokens"),
+        completion_tokens=usage.get("completion_tokens"),
+        ttft=None,
+        latency=round(latency, 3),
+        retries=retries,
+        cached=False,
+        batch=True,
+        **({"error": error} if error else {}),
+    )
+
+def _retry_delay(error, retries):
+    """Retry-After from the API if present, otherwise exponential backoff with jitter"""
+    response = getattr(error, "response", None)
+    try:
+        if response is not None and response.headers.get("retry-after"):
+            return float(response.headers["retry-after"])
+    except ValueError:
+        pass
+    return min(30.0, 2.0 ** retries) * random.uniform(0.5, 1.0)
+
+def _gateway_retries(raw):
+    try:
+        return int(raw.headers.get("x-gateway-retries", 0))
+    except ValueError:
+        return 0
+
+def _finish(step, subject, model, started_at, ttft, usage, retries):
+    record(
+        step, subject, model,
+        prompt_tokens=usage.prompt_tokens if usage else None,
+        completion_tokens=usage.completion_tokens if usage else None,
+        ttft=round(ttft, 3) if ttft is not None else None,
+        latency=round(time.time() - started_at, 3),
+        retries=retries,
+        cached=False,
+    )
+
+def _retryable(error, streaming):
+    """Errors before the response are retried if RETRYABLE_ERRORS; once the stream is open any transport/API error is"""
+    return isinstance(error, RETRYABLE_ERRORS) or (streaming and isinstance(error, STREAM_ERRORS))
+
+def streamed_completion(client, step, subject, on_delta=None, on_restart=None, **request):
+    """Run one chat completion as a stream, record its telemetry and return the full text.
+    
+    A stream that breaks off mid-answer is recorded as an error and the call
+    is made again, like a failed request; on_restart() is called first so the
+    caller can drop the partial text it got through on_delta.
+    """
+    started_at = time.time()
+    retries = 0
+    # Retry ở đây thay vì trong SDK để đếm được số lần retry
+    client = client.with_options(max_retries=0)
+    while True:
+        parts, ttft, usage, streaming = [], None, None, False
+        try:
+            raw = client.chat.completions.with_raw_response.create(
+                stream=True, stream_options={"include_usage": True}, **request
+            )
+            streaming = True
+            for chunk in raw.parse():
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.time() - started_at
+                    parts.append(chunk.choices[0].delta.content)
+                    if on_delta:
+                        on_delta(chunk.choices[0].delta.content)
+            break
+        except Exception as e:
+            if not _retryable(e, streaming):
+                raise
+            if streaming or retries >= MAX_RETRIES:
+                record(step, subject, request.get("model"), error=type(e).__name__, retries=retries,
+                       latency=round(time.time() - started_at, 3), cached=False)
+            if retries >= MAX_RETRIES:
+                raise
+            retries += 1
+            if streaming and parts and on_restart:
+                on_restart()
+            time.sleep(_retry_delay(e, retries))
+    _finish(step, subject, request.get("model"), started_at, ttft, usage, retries + _gateway_retries(raw))
+    return "".join(parts)
+
+async def streamed_completion_async(client, step, subject, on_delta=None, on_restart=None, **request):
+    """Async version of streamed_completion (AsyncOpenAI)"""
+    import asyncio
+    started_at = time.time()
+    retries = 0
+    client = client.with_options(max_retries=0)
+    while True:
+        parts, ttft, usage, streaming = [], None, None, False
+        try:
+            raw = await client.chat.completions.with_raw_response.create(
+                stream=True, stream_options={"include_usage": True}, **request
+            )
+            streaming = True
+            async for chunk in raw.parse():
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if ttft is None:
+                        ttft = time.time() - started_at
+                    parts.append(chunk.choices[0].delta.content)
+                    if on_delta:
+                        on_delta(chunk.choices[0].delta.content)
+            break
+        except Exception as e:
+            if not _retryable(e, streaming):
+                raise
+            if streaming or retries >= MAX_RETRIES:
+                await asyncio.to_thread(record, step, subject, request.get("model"), error=type(e).__name__,
+                                        retries=retries, latency=round(time.time() - started_at, 3), cached=False)
+            if retries >= MAX_RETRIES:
+                raise
+            retries += 1
+            if streaming and parts and on_restart:
+                on_restart()
+            await asyncio.sleep(_retry_delay(e, retries))
+    # Ghi file (có lock) ngoài event loop
+    await asyncio.to_thread(_finish, step, subject, request.get("model"), started_at, ttft, usage,
+                            retries + _gateway_retries(raw))
+    return "".join(parts)
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))]
+
+def load_records(path=TELEMETRY_FILE):
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+def print_report(path=TELEMETRY_FILE, since=None):
+    """Latency/TTFT percentiles, tokens and retries per step (since: only records with ts >= since)"""
+    records = load_records(path)
+    if since is not None:
+        # File giữ lại mọi lần chạy, chỉ lấy lần chạy này
+        records = [entry for entry in records if (entry.get("ts") or 0) >= since]
+    if not records:
+        print(f"📊 No LLM telemetry in {path}")
+        return False
+
+    by_step = {}
+    for entry in records:
+        by_step.setdefault(entry.get("step") or "unknown", []).append(entry)
+    steps = [s for s in STEP_ORDER if s in by_step] + sorted(s for s in by_step if s not in STEP_ORDER)
+    total_latency = sum(e.get("latency") or 0 for e in records if not e.get("cached"))
+
+    batch_count = sum(1 for e in records if e.get("batch"))
+    print(f"📊 LLM telemetry: {len(records)} calls in {path}" + (f" ({batch_count} via Batch API)" if batch_count else ""))
+    print(f"{'step':<11}{'calls':>6}{'cached':>7}{'errors':>7}{'retries':>8}"
+          f"{'lat p50':>9}{'p90':>7}{'p99':>7}{'ttft p50':>9}{'p90':>7}"
+          f"{'in tok':>8}{'out tok':>8}{'time %':>8}")
+    for step in steps:
+        entries = by_step[step]
+        called = [e for e in entries if not e.get("cached")]
+        latencies = [e["latency"] for e in called if e.get("latency") is not None and not e.get("error")]
+        ttfts = [e["ttft"] for e in called if e.get("ttft") is not None]
+        prompt_tokens = [e["prompt_tokens"] for e in called if e.get("prompt_tokens") is not None]
+        completion_tokens = [e["completion_tokens"] for e in called if e.get("completion_tokens") is not None]
+
+        def pct(values, q):
+            return f"{percentile(values, q):.1f}" if values else "-"
+
+        def avg(values):
+            return f"{sum(values) / len(values):.0f}" if values else "-"
+
+        share = sum(e.get("latency") or 0 for e in called) / total_latency * 100 if total_latency else 0.0
+        print(f"{step:<11}{len(entries):>6}{len(entries) - len(called):>7}{sum(1 for e in called if e.get('error')):>7}"
+              f"{sum(e.get('retries') or 0 for e in called):>8}"
+              f"{pct(latencies, 50):>9}{pct(latencies, 90):>7}{pct(latencies, 99):>7}"
+              f"{pct(ttfts, 50):>9}{pct(ttfts, 90):>7}"
+              f"{avg(prompt_tokens):>8}{avg(completion_tokens):>8}{share:>7.1f}%")
+    return True
+
+def main():
+    """Main function"""
+    if "--clear" in sys.argv[1:]:
+        if os.path.exists(TELEMETRY_FILE):
+            os.remove(TELEMETRY_FILE)
+        print(f"🧹 Cleared LLM telemetry: {TELEMETRY_FILE}")
+        return True
+
+    args = sys.argv[1:]
+    since = None
+    if "--since" in args:
+        index = args.index("--since")
+        since = float(args[index + 1])
+        del args[index:index + 2]
+    path = args[0] if args else TELEMETRY_FILE
+    return print_report(path, since)
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -3,9 +3,14 @@ import os
 import sys
 import subprocess
 import json
+import time
 import shutil
 from pathlib import Path
 
+import llm_gateway
+import llm_telemetry
+import tts_worker
+
 # Cấu hình paths
 BASE_DIR = "/app"
 INPUT_DIR = "/app"
@@ -17,6 +22,9 @@ SUBJECTS_FILE = os.path.join(INPUT_DIR, "subjects.txt")
 CONTENT_FILE = os.path.join(TEMP_DIR, "content.txt")
 PLAN_FILE = os.path.join(TEMP_DIR, "plan.txt")
 
+# Stream narration: TTS worker phải chạy từ bước 1 để nhận từng đoạn trong lúc LLM còn đang viết
+NARRATION_STREAM = os.getenv("NARRATION_STREAM", "0") == "1"
+
 def setup_directories():
     """Tạo các thư mục cần thiết"""
     os.makedirs(OUTPUT_DIR, exist_ok=True)
@@ -43,6 +51,11 @@ def check_input():
 def run_pipeline():
     """Chạy toàn bộ pipeline"""
     print("🚀 Bắt đầu chạy pipeline...")
+    # Báo cáo telemetry cuối pipeline chỉ tính các lời gọi LLM của lần chạy này
+    started_at = time.time()
+    worker_proc = tts_worker.start_worker() if NARRATION_STREAM else None
+    # 1 gateway cho cả generate_content và image_processor của mọi video
+    gateway_proc = llm_gateway.start_gateway()
     
     try:
         # Bước 1: Tạo nội dung
@@ -82,6 +95,7 @@ def run_pipeline():
             shutil.copytree(plan_dir, output_plan_dir)
             print("✅ Đã copy scripts vào output/scripts/")
         
+        llm_telemetry.print_report(since=started_at)
         print("\n🎉 Pipeline hoàn thành thành công!")
         return True
         
@@ -95,6 +109,9 @@ def run_pipeline():
     except Exception as e:
         print(f"❌ Lỗi không mong đợi: {e}")
         return False
+    finally:
+        tts_worker.stop_worker(worker_proc)
+        llm_gateway.stop_gateway(gateway_proc)
 
 def main():
     """Hàm main"""
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""Local stand-in for the image search backend, to test image_fetcher without network.
+
+Endpoints:
+    GET /search?q=...    page with image URLs in a <script> block, like Google Images
+    GET /img/{name}.jpg  generated JPEG (pattern from the keyword, size from the result index)
+    GET /stats           requests and peak concurrency per Host header
+
+The result links point at both 127.0.0.1 and localhost, so the fetcher sees two
+image hosts plus the search host. One link per page is broken (404) and one is
+not an image, to exercise candidate skipping.
+
+Usage:
+    python mock_image_server.py [port]
+    IMAGE_SEARCH_URL=http://127.0.0.1:8090/search python image_processor.py
+
+MOCK_IMAGE_LATENCY is the time per response; MOCK_IMAGE_HOST_CAPACITY answers
+429 once more requests than that are in flight to the same host.
+"""
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from urllib.parse import urlsplit, parse_qs, quote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+# Config
+MOCK_PORT = int(os.getenv("MOCK_IMAGE_PORT", "8090"))
+MOCK_LATENCY = float(os.getenv("MOCK_IMAGE_LATENCY", "0.2"))  # Giây mỗi response
+MOCK_HOST_CAPACITY = int(os.getenv("MOCK_IMAGE_HOST_CAPACITY", "0"))  # Request đồng thời tối đa mỗi host, 0 = không giới hạn
+RESULTS_PER_PAGE = 6
+
+# Per-host counters
+_lock = threading.Lock()
+_in_flight = {}
+_stats = {}
+
+def mock_image(name):
+    """Deterministic JPEG for /img/{keyword}-{i}.jpg.
+    
+    The picture (a 4x4 grid of colours) depends on the keyword only and its size
+    on i, so the results of one search are near-duplicates of each other, like
+    the same photo hosted on several sites.
+    """
+    keyword, _, index = name.rsplit(".", 1)[0].rpartition("-")
+    pattern = hashlib.sha512(keyword.encode("utf-8")).digest()
+    grid = Image.new("RGB", (4, 4))
+    grid.putdata([tuple(pattern[i * 3:i * 3 + 3]) for i in range(16)])
+    width = 320 + 40 * int(index or 0)
+    buffer = io.BytesIO()
+    grid.resize((width, width * 9 // 16), Image.BILINEAR).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+def search_page(keyword, port):
+    """HTML with escaped image URLs inside a script, the way the real results page embeds them"""
+    slug = quote(keyword.replace(" ", "_"), safe="")
+    urls = []
+    for i in range(RESULTS_PER_PAGE):
+        host = "127.0.0.1" if i % 2 == 0 else "localhost"
+        urls.append(f"http://{host}:{port}/img/{slug}-{i}.jpg")
+    urls.insert(1, f"http://127.0.0.1:{port}/missing/{slug}.jpg")
+    urls.insert(3, f"http://localhost:{port}/notimage/{slug}.jpg")
+    data = json.dumps([[1, [0, 0, [url, 720, 1280]]] for url in urls]).replace("/", "\\/")
+    return f"<html><head><script>var meta = 1;</script></head><body><script nonce=\"x\">AF_initDataCallback({{key: 'ds:1', data: {data}}});</script></body></html>"
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Search page, generated images and stats"""
+    protocol_version = "HTTP/1.1"
+
+    def send_bytes(self, data, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/stats":
+            with _lock:
+                payload = json.dumps(_stats).encode("utf-8")
+            return self.send_bytes(payload, "application/json")
+
+        host = self.headers.get("Host", "")
+        with _lock:
+            stats = _stats.setdefault(host, {"requests": 0, "peak_in_flight": 0, "rate_limited": 0})
+            stats["requests"] += 1
+            if MOCK_HOST_CAPACITY and _in_flight.get(host, 0) >= MOCK_HOST_CAPACITY:
+                stats["rate_limited"] += 1
+                overloaded = True
+            else:
+                overloaded = False
+                _in_flight[host] = _in_flight.get(host, 0) + 1
+                stats["peak_in_flight"] = max(stats["peak_in_flight"], _in_flight[host])
+        if overloaded:
+            return self.send_bytes(b'{"error": "too many requests"}', "application/json", 429)
+
+        try:
+            time.sleep(MOCK_LATENCY)
+            if url.path == "/search":
+                keyword = parse_qs(url.query).get("q", [""])[0]
+                return self.send_bytes(search_page(keyword, self.server.server_port).encode("utf-8"), "text/html; charset=utf-8")
+            if url.path.startswith("/img/"):
+                return self.send_bytes(mock_image(url.path), "image/jpeg")
+            if url.path.startswith("/notimage/"):
+                return self.send_bytes(b"<html>not an image</html>", "image/jpeg")
+            self.send_bytes(b"not found", "text/plain", 404)
+        finally:
+            with _lock:
+                _in_flight[host] -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    """Main function"""
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else MOCK_PORT
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    print(f"🧪 Mock image search on http://127.0.0.1:{port}/search")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
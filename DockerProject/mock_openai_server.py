@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Local stand-in for the OpenAI API, to run the pipeline without network or cost.
+
+Endpoints:
+    POST /v1/chat/completions (also stream=True as server-sent events)
+    POST /v1/files, GET /v1/files/{id}/content
+    POST /v1/batches, GET /v1/batches/{id}
+
+Usage:
+    python mock_openai_server.py [port]
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock CONTENT_MODE=batch python generate_content.py
+
+Rate limits can be simulated for the LLM gateway: MOCK_CAPACITY answers 429
+once more chat requests than that are in flight, MOCK_FAIL_RATE adds random
+429/503 responses, MOCK_LATENCY is the time per answer.
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Config
+MOCK_PORT = int(os.getenv("MOCK_OPENAI_PORT", "8089"))
+MOCK_WORDS = int(os.getenv("MOCK_WORDS", "300"))  # Độ dài mỗi câu trả lời
+MOCK_BATCH_SECONDS = float(os.getenv("MOCK_BATCH_SECONDS", "0"))  # Thời gian một batch ở trạng thái in_progress
+MOCK_LATENCY = float(os.getenv("MOCK_LATENCY", "0"))  # Giây cho mỗi câu trả lời chat
+MOCK_CAPACITY = int(os.getenv("MOCK_CAPACITY", "0"))  # Số chat request đồng thời tối đa, 0 = không giới hạn
+MOCK_FAIL_RATE = float(os.getenv("MOCK_FAIL_RATE", "0"))  # Tỉ lệ 429/503 ngẫu nhiên
+
+# In-memory storage
+_files = {}
+_batches = {}
+_lock = threading.Lock()
+_in_flight = 0
+_served = {"ok": 0, "rate_limited": 0}
+
+def mock_answer(body):
+    """Deterministic text for a chat request: paragraphs of 5 sentences, about MOCK_WORDS words.
+    
+    Batched keyword prompts (image_processor) get a JSON array with one keyword per [N] paragraph.
+    """
+    digest = hashlib.sha256(json.dumps(body.get("messages", []), sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    prompt = str((body.get("messages") or [{}])[-1].get("content", ""))
+    if "Return only a JSON array" in prompt:
+        indexes = [int(i) for i in re.findall(r"^\[(\d+)\] ", prompt, re.MULTILINE)]
+        return json.dumps([{"index": i, "keyword": f"mock keyword {digest} {i}"} for i in indexes])
+    sentences = [f"Mock sentence {i + 1} of answer {digest} has eight words." for i in range(max(1, MOCK_WORDS // 8))]
+    return "\n\n".join(" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5))
+
+def mock_completion(body):
+    """chat.completion object for a request body"""
+    content = mock_answer(body)
+    prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                  "total_tokens": prompt_tokens + completion_tokens},
+    }
+
+def store_file(data, filename, purpose):
+    file_id = f"file-mock-{uuid.uuid4().hex[:12]}"
+    with _lock:
+        _files[file_id] = {"data": data, "filename": filename, "purpose": purpose, "created_at": int(time.time())}
+    return file_id
+
+def file_object(file_id):
+    entry = _files[file_id]
+    return {"id": file_id, "object": "file", "bytes": len(entry["data"]), "created_at": entry["created_at"],
+            "filename": entry["filename"], "purpose": entry["purpose"], "status": "processed"}
+
+def run_batch(batch_id):
+    """Answer every line of the input file and attach the output file"""
+    batch = _batches[batch_id]
+    lines = [json.loads(line) for line in _files[batch["input_file_id"]]["data"].decode("utf-8").splitlines() if line.strip()]
+    output = []
+    for line in lines:
+        output.append(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+            "custom_id": line["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": mock_completion(line["body"])},
+            "error": None,
+        }))
+    output_file_id = store_file(("\n".join(output) + "\n").encode("utf-8"), f"{batch_id}_output.jsonl", "batch_output")
+    with _lock:
+        batch.update({
+            "status": "completed",
+            "output_file_id": output_file_id,
+            "completed_at": int(time.time()),
+            "request_counts": {"total": len(lines), "completed": len(lines), "failed": 0},
+        })
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Route the few OpenAI endpoints the pipeline uses"""
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path.endswith("/chat/completions"):
+            return self.chat_completion(json.loads(self.read_body()))
+
+        if path.endswith("/files"):
+            # multipart/form-data: purpose + file
+            message = BytesParser().parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + self.read_body()
+            )
+            fields = {part.get_param("name", header="content-disposition"): part for part in message.get_payload()}
+            file_part = fields["file"]
+            purpose = fields["purpose"].get_payload(decode=True).decode("utf-8")
+            file_id = store_file(file_part.get_payload(decode=True), file_part.get_filename() or "upload.jsonl", purpose)
+            return self.send_json(file_object(file_id))
+
+        if path.endswith("/batches"):
+            body = json.loads(self.read_body())
+            if body.get("input_file_id") not in _files:
+                return self.send_json({"error": {"message": "input file not found"}}, 404)
+            batch_id = f"batch_mock_{uuid.uuid4().hex[:12]}"
+            total = len([line for line in _files[body["input_file_id"]]["data"].splitlines() if line.strip()])
+            with _lock:
+                _batches[batch_id] = {
+                    "id": batch_id, "object": "batch", "endpoint": body["endpoint"],
+                    "input_file_id": body["input_file_id"], "completion_window": body["completion_window"],
+                    "status": "in_progress", "created_at": int(time.time()),
+                    "output_file_id": None, "error_file_id": None,
+                    "request_counts": {"total": total, "completed": 0, "failed": 0},
+                }
+            threading.Timer(MOCK_BATCH_SECONDS, run_batch, args=(batch_id,)).start()
+            return self.send_json(_batches[batch_id])
+
+        self.send_json({"error": {"message": f"unknown endpoint {path}"}}, 404)
+
+    def chat_completion(self, body):
+        """Answer one chat request, or 429/503 when over capacity or by MOCK_FAIL_RATE"""
+        global _in_flight
+        with _lock:
+            overloaded = (MOCK_CAPACITY and _in_flight >= MOCK_CAPACITY) or random.random() < MOCK_FAIL_RATE
+            if overloaded:
+                _served["rate_limited"] += 1
+            else:
+                _in_flight += 1
+        if overloaded:
+            status = 429 if random.random() < 0.8 else 503
+            self.send_response(status)
+            self.send_header("Retry-After", "1")
+            data = json.dumps({"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}}).encode("utf-8")
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+
+        try:
+            completion = mock_completion(body)
+            if not body.get("stream"):
+                time.sleep(MOCK_LATENCY)
+                return self.send_json(completion)
+            self.stream_completion(body, completion)
+        finally:
+            with _lock:
+                _in_flight -= 1
+                _served["ok"] += 1
+
+    def stream_completion(self, body, completion):
+        """Server-sent events: one chunk per word, then usage (if asked for) and [DONE]"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        base = {"id": completion["id"], "object": "chat.completion.chunk", "created": completion["created"], "model": completion["model"]}
+        words = completion["choices"][0]["message"]["content"].split(" ")
+        for i, word in enumerate(words):
+            time.sleep(MOCK_LATENCY / max(1, len(words)))
+            delta = {"content": word if i == 0 else " " + word}
+            send_event(json.dumps({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}))
+        send_event(json.dumps({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({**base, "choices": [], "usage": completion["usage"]}))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content" and parts[-2] in _files:
+            data = _files[parts[-2]]["data"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if parts == ["stats"]:
+            return self.send_json({"in_flight": _in_flight, **_served})
+        if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in _batches:
+            return self.send_json(_batches[parts[-1]])
+        self.send_json({"error": {"message": f"unknown endpoint {self.path}"}}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+    """Main function"""
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else MOCK_PORT
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    print(f"🧪 Mock OpenAI API on http://127.0.0.1:{port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
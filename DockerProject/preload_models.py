@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""Download Kokoro weights, config, voice packs and the spaCy English model
+into the image at build time, so containers start without network access.
+
+Usage:
+    python preload_models.py [voice,voice,...]
+"""
+import os
+import sys
+import time
+import subprocess
+
+from huggingface_hub import hf_hub_download
+
+import tts_backends
+
+# Config
+PRELOAD_VOICES = os.getenv("TTS_PRELOAD_VOICES", "af_heart")
+SPACY_MODEL = "en_core_web_sm"  # misaki en G2P tải model này lúc chạy nếu chưa có
+
+def preload_kokoro(voices):
+    """Snapshot config.json, the .pth weights and voice packs into TTS_MODEL_DIR"""
+    filenames = ["config.json", tts_backends.MODEL_FILE] + [f"voices/{voice}.pt" for voice in voices]
+    os.makedirs(tts_backends.MODEL_DIR, exist_ok=True)
+    for filename in filenames:
+        path = hf_hub_download(repo_id=tts_backends.REPO_ID, filename=filename, local_dir=tts_backends.MODEL_DIR)
+        print(f"📦 {filename}: {os.path.getsize(path) / (1024 * 1024):.1f} MB")
+
+def preload_spacy():
+    """Install the spaCy model as a package so misaki never downloads it at runtime"""
+    import spacy
+    if spacy.util.is_package(SPACY_MODEL):
+        print(f"✅ spaCy {SPACY_MODEL} already installed")
+        return
+    spacy.cli.download(SPACY_MODEL)
+
+VERIFY_SCRIPT = """
+import sys, tts_backends
+backend = tts_backends.load_backend("torch", "a", sys.argv[1])
+print(sum(len(chunk) for chunk in backend.synthesize("Offline model check.")))
+"""
+
+def verify_offline(voices):
+    """Load the pipeline from the local snapshot and synthesize one segment, with the Hub disabled"""
+    # huggingface_hub đọc HF_HUB_OFFLINE lúc import (đã import ở trên), nên kiểm tra trong process mới
+    env = {**os.environ, "HF_HUB_OFFLINE": "1", "TRANSFORMERS_OFFLINE": "1"}
+    start = time.time()
+    result = subprocess.run([sys.executable, "-c", VERIFY_SCRIPT, voices[0]], env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"offline load failed:\n{result.stderr.strip()}")
+    samples = result.stdout.strip().splitlines()[-1]
+    print(f"✅ Offline load + first segment: {time.time() - start:.1f}s, {samples} samples")
+
+def main():
+    """Main function"""
+    voices = (sys.argv[1] if len(sys.argv) > 1 else PRELOAD_VOICES).split(",")
+    print(f"🚀 Preloading Kokoro ({tts_backends.REPO_ID}) into {tts_backends.MODEL_DIR}")
+    try:
+        preload_kokoro(voices)
+        preload_spacy()
+        verify_offline(voices)
+    except Exception as e:
+        print(f"❌ Preload failed: {e}")
+        return False
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
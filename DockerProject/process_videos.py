@@ -5,6 +5,9 @@ import subprocess
 import json
 import sys
 
+import llm_gateway
+import tts_worker
+
 # Paths
 PLAN_DIR = "/app/temp/plan"
 PLAN_FILE = "/app/temp/plan.txt"
@@ -21,6 +24,9 @@ FINAL_VIDEO = "/app/temp/final_video.mp4"
 TIMEOUT_SECONDS = 1800
 MAX_RETRIES = 2
 
+# "stream": audio đi thẳng từ TTS vào ffmpeg ở bước combine; "file": ghi my_audio/*.wav (debug)
+TTS_OUTPUT = os.getenv("TTS_OUTPUT", "file")
+
 def load_progress():
     """Load progress from file"""
     if os.path.exists(PROGRESS_FILE):
@@ -68,14 +74,18 @@ def process_single_video(title, script_path):
     shutil.copy(script_path, CURRENT_SCRIPT_FILE)
     
     # Step 1: Clean up and generate audio
-    print("🔹 Step 1: Generating audio...")
-    subprocess.run([sys.executable, "audio_generator.py"], 
-                  check=True, timeout=TIMEOUT_SECONDS)
+    if TTS_OUTPUT == "stream":
+        print("🔹 Step 1: Audio will be streamed into the video encoder (step 3)")
+    else:
+        print("🔹 Step 1: Generating audio...")
+        subprocess.run([sys.executable, "audio_generator.py"], 
+                      check=True, timeout=TIMEOUT_SECONDS)
     
     # Step 2: Generate keywords and download images
     print("🔹 Step 2: Generating keywords and downloading images...")
+    # VIDEO_TITLE: subject của các bản ghi keyword trong llm_telemetry
     subprocess.run([sys.executable, "image_processor.py"], 
-                  check=True, timeout=TIMEOUT_SECONDS)
+                  check=True, timeout=TIMEOUT_SECONDS, env={**os.environ, "VIDEO_TITLE": title})
     
     # Step 3: Combine audio and images into video
     print("🔹 Step 3: Combining audio and images...")
@@ -114,40 +124,49 @@ def process_videos():
     
     pending_tasks = tasks_to_process[:]  # List of videos to process
 
-    while pending_tasks:
-        next_round = []  # Save videos that need retry
-        for task in pending_tasks:
-            title = task["title"]
-            script_path = task["script"]
-
-            try:
-                process_single_video(title, script_path)
-                progress[title] = {"status": "done", "retries": task["retries"]}
-                save_progress(progress)
+    # Keep Kokoro loaded across videos instead of reloading it per video
+    worker_proc = tts_worker.start_worker() if pending_tasks else None
+    # image_processor runs once per video: share one pooled connection to the API
+    gateway_proc = llm_gateway.start_gateway() if pending_tasks else None
+
+    try:
+        while pending_tasks:
+            next_round = []  # Save videos that need retry
+            for task in pending_tasks:
+                title = task["title"]
+                script_path = task["script"]
+
+                try:
+                    process_single_video(title, script_path)
+                    progress[title] = {"status": "done", "retries": task["retries"]}
+                    save_progress(progress)
                 
-            except subprocess.TimeoutExpired:
-                task["retries"] += 1
-                progress[title] = {"status": "timeout", "retries": task["retries"]}
-                save_progress(progress)
-                if task["retries"] < MAX_RETRIES:
-                    print(f"⏳ Retrying video: {title} (Attempt {task['retries']})")
-                    next_round.append(task)
-                else:
-                    print(f"❌ Video {title} timed out {MAX_RETRIES} times, skipping.")
-                    progress[title] = {"status": "failed", "message": "timeout exceeded", "retries": task["retries"]}
+                except subprocess.TimeoutExpired:
+                    task["retries"] += 1
+                    progress[title] = {"status": "timeout", "retries": task["retries"]}
                     save_progress(progress)
+                    if task["retries"] < MAX_RETRIES:
+                        print(f"⏳ Retrying video: {title} (Attempt {task['retries']})")
+                        next_round.append(task)
+                    else:
+                        print(f"❌ Video {title} timed out {MAX_RETRIES} times, skipping.")
+                        progress[title] = {"status": "failed", "message": "timeout exceeded", "retries": task["retries"]}
+                        save_progress(progress)
                 
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Error processing {title}: {e}")
-                progress[title] = {"status": "error", "message": str(e), "retries": task["retries"]}
-                save_progress(progress)
+                except subprocess.CalledProcessError as e:
+                    print(f"❌ Error processing {title}: {e}")
+                    progress[title] = {"status": "error", "message": str(e), "retries": task["retries"]}
+                    save_progress(progress)
                 
-            except Exception as e:
-                print(f"❌ Unexpected error processing {title}: {e}")
-                progress[title] = {"status": "error", "message": str(e), "retries": task["retries"]}
-                save_progress(progress)
+                except Exception as e:
+                    print(f"❌ Unexpected error processing {title}: {e}")
+                    progress[title] = {"status": "error", "message": str(e), "retries": task["retries"]}
+                    save_progress(progress)
 
-        pending_tasks = next_round  # Retry failed videos
+            pending_tasks = next_round  # Retry failed videos
+    finally:
+        tts_worker.stop_worker(worker_proc)
+        llm_gateway.stop_gateway(gateway_proc)
 
     print("🎉 All videos processed!")
 
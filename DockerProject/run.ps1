@@ -41,7 +41,9 @@ if (-not (Test-Path "output")) {
 # Build Docker image
 Write-Host "Building Docker image..." -ForegroundColor Yellow
 try {
-    docker build -t video-generation-pipeline .
+    # $env:OFFLINE_MODELS = "1"; $env:TORCH_INDEX_URL = "https://download.pytorch.org/whl/cpu" -> image slim, chạy offline
+    $offlineModels = if ($env:OFFLINE_MODELS) { $env:OFFLINE_MODELS } else { "0" }
+    docker build --build-arg OFFLINE_MODELS=$offlineModels --build-arg TORCH_INDEX_URL="$env:TORCH_INDEX_URL" -t video-generation-pipeline .
     Write-Host "Build successful!" -ForegroundColor Green
 } catch {
     Write-Host "Build failed!" -ForegroundColor Red
@@ -29,7 +29,11 @@ mkdir -p output
 
 # Build Docker image
 echo "🔨 Building Docker image: $IMAGE_NAME"
-if docker build -t $IMAGE_NAME .; then
+# OFFLINE_MODELS=1 TORCH_INDEX_URL=https://download.pytorch.org/whl/cpu ./run.sh -> image slim, chạy offline
+if docker build \
+    --build-arg OFFLINE_MODELS="${OFFLINE_MODELS:-0}" \
+    --build-arg TORCH_INDEX_URL="${TORCH_INDEX_URL:-}" \
+    -t $IMAGE_NAME .; then
     echo "✅ Build thành công!"
 else
     echo "❌ Build thất bại!"
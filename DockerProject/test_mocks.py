@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Checks for llm_gateway and image_fetcher against the local mock servers.
+
+Each test starts its mock (and the gateway) as a subprocess on a free port:
+    python test_mocks.py
+    python -m pytest test_mocks.py
+"""
+import os
+import sys
+import time
+import socket
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(script, port, url, **env):
+    """Run script with env overrides and wait until url answers"""
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, script), str(port)],
+                            env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return proc
+        except requests.RequestException:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{script} did not start")
+
+def stop_server(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+def start_gateway(mock_env):
+    """Mock OpenAI API + llm_gateway in front of it, return (procs, gateway port)"""
+    mock_port, gateway_port = free_port(), free_port()
+    mock = start_server("mock_openai_server.py", mock_port, f"http://127.0.0.1:{mock_port}/stats", **mock_env)
+    gateway = start_server("llm_gateway.py", gateway_port, f"http://127.0.0.1:{gateway_port}/health",
+                           LLM_GATEWAY_PORT=str(gateway_port),
+                           LLM_GATEWAY_UPSTREAM=f"http://127.0.0.1:{mock_port}/v1")
+    return [gateway, mock], gateway_port
+
+def chat(gateway_port, prompt):
+    return requests.post(f"http://127.0.0.1:{gateway_port}/v1/chat/completions", timeout=60, json={
+        "model": "gpt-4o-mini", "messages": [{"role": "user", "content": prompt}],
+    })
+
+def test_gateway_forwards_chat():
+    """Happy path: the answer comes back through the gateway untouched, no retries"""
+    procs, port = start_gateway({})
+    try:
+        response = chat(port, "Hello")
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"].startswith("Mock sentence")
+        assert response.headers["X-Gateway-Retries"] == "0"
+        health = requests.get(f"http://127.0.0.1:{port}/health", timeout=5).json()
+        assert health["requests"] == 1 and health["overloaded"] == 0
+    finally:
+        for proc in procs:
+            stop_server(proc)
+
+def test_gateway_backs_off_on_429():
+    """Mock takes 2 requests at a time: 8 concurrent calls all succeed, the AIMD limit is cut"""
+    procs, port = start_gateway({"MOCK_CAPACITY": "2", "MOCK_LATENCY": "0.5"})
+    try:
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda i: chat(port, f"Question {i}"), range(8)))
+        assert [response.status_code for response in responses] == [200] * 8
+        health = requests.get(f"http://127.0.0.1:{port}/health", timeout=5).json()
+        assert health["overloaded"] > 0 and health["retries"] > 0 and health["failed"] == 0
+        assert health["limit"] < 8
+    finally:
+        for proc in procs:
+            stop_server(proc)
+
+def fetch_with_mock(keywords, host_capacity="0"):
+    """Run image_fetcher.fetch_images against mock_image_server, return (results, mock /stats)"""
+    import image_fetcher
+    port = free_port()
+    mock = start_server("mock_image_server.py", port, f"http://127.0.0.1:{port}/stats",
+                        MOCK_IMAGE_LATENCY="0.1", MOCK_IMAGE_HOST_CAPACITY=host_capacity)
+    image_fetcher.SEARCH_URL = f"http://127.0.0.1:{port}/search"
+    image_fetcher._host_slots.clear()
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            jobs = [(i, keyword, os.path.join(temp_dir, f"output_{i}.jpg")) for i, keyword in enumerate(keywords)]
+            results = image_fetcher.fetch_images(jobs)
+            assert all(os.path.getsize(path) > 0 for i, _, path in jobs if results[i])
+        return results, requests.get(f"http://127.0.0.1:{port}/stats", timeout=5).json()
+    finally:
+        stop_server(mock)
+
+def test_image_fetcher_downloads_every_keyword():
+    """Happy path: every keyword gets an image, broken and non-image links are skipped"""
+    results, _ = fetch_with_mock(["black hole", "surface of the Moon"])
+    assert results == {0: True, 1: True}
+
+def test_image_fetcher_stays_under_host_limit():
+    """Mock answers 429 past 2 requests per host: the per-host slots must never trigger it"""
+    import image_fetcher
+    limits = image_fetcher.PER_HOST_LIMIT, image_fetcher.SEARCH_HOST_LIMIT
+    image_fetcher.PER_HOST_LIMIT, image_fetcher.SEARCH_HOST_LIMIT = 2, 2
+    try:
+        results, stats = fetch_with_mock([f"keyword {i}" for i in range(8)], host_capacity="2")
+    finally:
+        image_fetcher.PER_HOST_LIMIT, image_fetcher.SEARCH_HOST_LIMIT = limits
+        image_fetcher._host_slots.clear()
+    assert all(results.values())
+    for host, host_stats in stats.items():
+        assert host_stats["rate_limited"] == 0, host
+        assert host_stats["peak_in_flight"] <= 2, host
+
+if __name__ == "__main__":
+    tests = [test_gateway_forwards_chat, test_gateway_backs_off_on_429,
+             test_image_fetcher_downloads_every_keyword, test_image_fetcher_stays_under_host_limit]
+    failed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__name__}")
+        except Exception as e:
+            failed += 1
+            print(f"❌ {test.__name__}: {e!r}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""Pluggable TTS backends behind audio_generator.text_to_speech_kokoro.
+
+Every backend exposes the same small interface:
+    g2p(text)               -> (phonemes, tokens), like KPipeline.g2p
+    synthesize(text)        -> yields float32 audio chunks as they are produced
+    phonemize(text)         -> yields (graphemes, phonemes), one per model call (CPU-side G2P only)
+    infer(phonemes)         -> float32 audio for one phoneme string (acoustic model only)
+    infer_batch(phonemes)   -> one float32 array per phoneme string, run as a batch where possible
+
+KokoroG2P implements only g2p/phonemize, for segmenting text without a model.
+
+Backends (TTS_BACKEND):
+    torch       eager fp32 PyTorch KPipeline (default)
+    torch-int8  same pipeline with the model dynamically quantized to int8
+    onnx        Kokoro G2P + an exported ONNX graph run with onnxruntime
+
+When preload_models.py has put a snapshot of the model in TTS_MODEL_DIR,
+weights, config and voice packs are loaded from there (weights memory-mapped)
+and nothing is fetched from the Hugging Face Hub.
+"""
+import os
+import json
+import numpy as np
+
+try:
+    import kokoro
+    import torch
+    KOKORO_AVAILABLE = True
+except ImportError:
+    KOKORO_AVAILABLE = False
+
+try:
+    import onnxruntime
+    ONNX_AVAILABLE = True
+except ImportError:
+    ONNX_AVAILABLE = False
+
+# Config
+REPO_ID = "hexgrad/Kokoro-82M"
+MODEL_DIR = os.getenv("TTS_MODEL_DIR", "/app/models/Kokoro-82M")
+MODEL_FILE = "kokoro-v1_0.pth"
+ONNX_MODEL_PATH = os.getenv("TTS_ONNX_MODEL", "/app/models/kokoro.onnx")
+MAX_PHONEMES = 510  # Context của model là 512 tokens gồm 2 token pad
+
+def extract_audio(audio_item):
+    """Extract a flat float32 numpy array from a Kokoro Result object"""
+    if hasattr(audio_item, 'output'):
+        if hasattr(audio_item.output, 'audio'):
+            audio = audio_item.output.audio
+        else:
+            audio = audio_item.output
+    else:
+        audio = audio_item
+
+    if audio is None:
+        return None
+
+    # Convert tensor to numpy
+    if torch.is_tensor(audio):
+        audio = audio.detach().cpu().numpy()
+
+    # Flatten if needed
+    if audio.ndim > 1:
+        audio = audio.reshape(-1)
+
+    return audio.astype(np.float32, copy=False)
+
+def has_local_model():
+    """True when preload_models.py has snapshotted the model into MODEL_DIR"""
+    return all(os.path.exists(os.path.join(MODEL_DIR, name)) for name in ("config.json", MODEL_FILE))
+
+def local_config_path():
+    if has_local_model():
+        return os.path.join(MODEL_DIR, "config.json")
+    from huggingface_hub import hf_hub_download
+    return hf_hub_download(repo_id=REPO_ID, filename="config.json")
+
+def resolve_voice(voice):
+    """Path of a preloaded voice pack, else the voice name (downloaded by KPipeline)"""
+    path = os.path.join(MODEL_DIR, "voices", f"{voice}.pt")
+    return path if os.path.exists(path) else voice
+
+def load_local_model():
+    """KModel from MODEL_DIR with memory-mapped weights, or True to let KPipeline download it"""
+    if not has_local_model():
+        return True
+    # KModel tự gọi torch.load nên không truyền mmap=True được: bật cấu hình mmap (torch >= 2.5)
+    # chỉ trong lúc dựng model rồi trả lại giá trị cũ, không ảnh hưởng các torch.load khác
+    try:
+        from torch.utils.serialization import config as serialization_config
+    except ImportError:
+        serialization_config = None
+        print(f"⚠️ torch {torch.__version__} has no mmap load config (needs >= 2.5), reading weights into RAM")
+    previous = serialization_config.load.mmap if serialization_config else None
+    if serialization_config:
+        serialization_config.load.mmap = True
+    try:
+        model = kokoro.KModel(
+            repo_id=REPO_ID,
+            config=os.path.join(MODEL_DIR, "config.json"),
+            model=os.path.join(MODEL_DIR, MODEL_FILE),
+        )
+    finally:
+        if serialization_config:
+            serialization_config.load.mmap = previous
+    return model.to("cuda" if torch.cuda.is_available() else "cpu").eval()
+
+def en_phonemize(pipeline, text):
+    """(graphemes, phonemes) chunks of ≤ MAX_PHONEMES for an English KPipeline, G2P run once"""
+    _, tokens = pipeline.g2p(text)
+    if tokens is None:
+        raise RuntimeError("phonemize() needs an English pipeline (lang_code 'a' or 'b')")
+    for graphemes, phonemes, _ in pipeline.en_tokenize(tokens):
+        if phonemes:
+            yield graphemes, phonemes[:MAX_PHONEMES]
+
+def forward_batch(model, phonemes_list, voice_pack, speed=1):
+    """KModel.forward_with_tokens for several phoneme strings at once.
+
+    BERT, the duration predictor and the text encoder run on one padded
+    batch; they mask or pack the padding, so every item gets the same
+    durations and features as on its own. Alignment, F0/energy and the
+    decoder still run per item: their instance norms and the bidirectional
+    F0 LSTM would see the padding frames.
+    """
+    device = model.device
+    ids = [[0, *(model.vocab[p] for p in phonemes if p in model.vocab), 0] for phonemes in phonemes_list]
+    input_lengths = torch.tensor([len(item) for item in ids], dtype=torch.long)
+    input_ids = torch.zeros((len(ids), int(input_lengths.max())), dtype=torch.long)
+    for index, item in enumerate(ids):
+        input_ids[index, :len(item)] = torch.tensor(item, dtype=torch.long)
+    input_ids = input_ids.to(device)
+    # True = padding, như text_mask của KModel
+    text_mask = (torch.arange(input_ids.shape[1]).unsqueeze(0) + 1 > input_lengths.unsqueeze(1)).to(device)
+    ref_s = torch.cat([voice_pack[len(phonemes) - 1] for phonemes in phonemes_list]).to(device)
+    s = ref_s[:, 128:]
+
+    bert_dur = model.bert(input_ids, attention_mask=(~text_mask).int())
+    d_en = model.bert_encoder(bert_dur).transpose(-1, -2)
+    d = model.predictor.text_encoder(d_en, s, input_lengths, text_mask)
+    # KModel chạy LSTM này không pack (batch 1), ở đây phải pack để bỏ padding
+    packed = torch.nn.utils.rnn.pack_padded_sequence(d, input_lengths, batch_first=True, enforce_sorted=False)
+    x, _ = model.predictor.lstm(packed)
+    x, _ = torch.nn.utils.rnn.pad_packed_sequence(x, batch_first=True, total_length=input_ids.shape[1])
+    duration = torch.sigmoid(model.predictor.duration_proj(x)).sum(axis=-1) / speed
+    t_en = model.text_encoder(input_ids, input_lengths, text_mask)
+
+    audios = []
+    for index, length in enumerate(input_lengths.tolist()):
+        pred_dur = torch.round(duration[index, :length]).clamp(min=1).long()
+        indices = torch.repeat_interleave(torch.arange(length, device=device), pred_dur)
+        pred_aln_trg = torch.zeros((length, indices.shape[0]), device=device)
+        pred_aln_trg[indices, torch.arange(indices.shape[0], device=device)] = 1
+        pred_aln_trg = pred_aln_trg.unsqueeze(0)
+        en = d[index:index + 1, :length].transpose(-1, -2) @ pred_aln_trg
+        F0_pred, N_pred = model.predictor.F0Ntrain(en, s[index:index + 1])
+        asr = t_en[index:index + 1, :, :length] @ pred_aln_trg
+        audio = model.decoder(asr, F0_pred, N_pred, ref_s[index:index + 1, :128])
+        audios.append(extract_audio(audio))
+    return audios
+
+class KokoroG2P:
+    """Kokoro G2P without the acoustic model"""
+    name = "g2p"
+
+    def __init__(self, lang_code):
+        self.pipeline = kokoro.KPipeline(lang_code=lang_code, repo_id=REPO_ID, model=False)
+
+    def g2p(self, text):
+        return self.pipeline.g2p(text)
+
+    def phonemize(self, text):
+        return en_phonemize(self.pipeline, text)
+
+class KokoroTorchBackend:
+    """Eager fp32 PyTorch Kokoro pipeline"""
+    name = "torch"
+
+    def __init__(self, lang_code, voice, num_threads=None):
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.voice = resolve_voice(voice)
+        self.pipeline = kokoro.KPipeline(lang_code=lang_code, repo_id=REPO_ID, model=load_local_model())
+        self.voice_pack = None
+
+    def g2p(self, text):
+        return self.pipeline.g2p(text)
+
+    def phonemize(self, text):
+        return en_phonemize(self.pipeline, text)
+
+    def infer(self, phonemes):
+        if self.voice_pack is None:
+            self.voice_pack = self.pipeline.load_voice(self.voice).to(self.pipeline.model.device)
+        # KPipeline.infer trả về KModel.Output(audio, pred_dur), không phải Result
+        output = kokoro.KPipeline.infer(self.pipeline.model, phonemes, self.voice_pack)
+        return extract_audio(output.audio)
+
+    def infer_batch(self, phonemes_list):
+        if self.voice_pack is None:
+            self.voice_pack = self.pipeline.load_voice(self.voice).to(self.pipeline.model.device)
+        with torch.no_grad():
+            return forward_batch(self.pipeline.model, phonemes_list, self.voice_pack)
+
+    def synthesize(self, text):
+        for result in self.pipeline(text, voice=self.voice):
+            audio = extract_audio(result)
+            if audio is not None and len(audio):
+                yield audio
+
+class KokoroInt8Backend(KokoroTorchBackend):
+    """Kokoro with Linear/LSTM layers dynamically quantized to int8 for CPU"""
+    name = "torch-int8"
+
+    def __init__(self, lang_code, voice, num_threads=None):
+        super().__init__(lang_code, voice, num_threads)
+        self.pipeline.model = torch.ao.quantization.quantize_dynamic(
+            self.pipeline.model, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8
+        )
+
+class KokoroOnnxBackend:
+    """Kokoro G2P in Python, acoustic model as an ONNX graph on onnxruntime.
+
+    Expects a Kokoro-82M export with inputs input_ids (int64 [1, T]),
+    style (float32 [1, 256]) and speed (float32 [1]), e.g. the
+    onnx-community/Kokoro-82M-v1.0-ONNX model, at TTS_ONNX_MODEL.
+    """
+    name = "onnx"
+
+    def __init__(self, lang_code, voice, num_threads=None):
+        if not ONNX_AVAILABLE:
+            raise RuntimeError("onnxruntime is not installed")
+        if not os.path.exists(ONNX_MODEL_PATH):
+            raise FileNotFoundError(f"ONNX model not found: {ONNX_MODEL_PATH}")
+
+        # G2P only, không load model PyTorch
+        self.g2p_pipeline = kokoro.KPipeline(lang_code=lang_code, repo_id=REPO_ID, model=False)
+        self.voice = resolve_voice(voice)
+        self.voice_pack = self.g2p_pipeline.load_voice(self.voice)
+        with open(local_config_path(), "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)["vocab"]
+
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(ONNX_MODEL_PATH, options, providers=["CPUExecutionProvider"])
+
+    def g2p(self, text):
+        return self.g2p_pipeline.g2p(text)
+
+    def phonemize(self, text):
+        # Pipeline không có model chỉ trả về phonemes theo từng chunk ≤ 510
+        for result in self.g2p_pipeline(text, voice=self.voice):
+            if result.phonemes:
+                yield result.graphemes, result.phonemes[:MAX_PHONEMES]
+
+    def infer(self, phonemes):
+        input_ids = [0] + [self.vocab[p] for p in phonemes if p in self.vocab] + [0]
+        style = self.voice_pack[len(phonemes) - 1].numpy().astype(np.float32)
+        outputs = self.session.run(None, {
+            "input_ids": np.array([input_ids], dtype=np.int64),
+            "style": style,
+            "speed": np.array([1.0], dtype=np.float32),
+        })
+        return outputs[0].reshape(-1).astype(np.float32, copy=False)
+
+    def infer_batch(self, phonemes_list):
+        # Graph export có batch cố định 1
+        return [self.infer(phonemes) for phonemes in phonemes_list]
+
+    def synthesize(self, text):
+        for _, phonemes in self.phonemize(text):
+            yield self.infer(phonemes)
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (KokoroTorchBackend, KokoroInt8Backend, KokoroOnnxBackend)
+}
+
+def load_backend(name, lang_code, voice, num_threads=None):
+    """Create the backend registered under name"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown TTS backend: {name} (available: {', '.join(BACKENDS)})")
+    if not KOKORO_AVAILABLE:
+        raise RuntimeError("Kokoro is not installed")
+    return BACKENDS[name](lang_code, voice, num_threads)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Content-addressed on-disk cache for synthesized TTS segments.
+
+Each segment is stored as raw little-endian float32 samples (.f32) named by
+the hash of everything that affects the audio (normalized text, voice,
+lang_code, sample rate, model version). Entries are written chunk by chunk
+while Kokoro produces them and read back memory-mapped. File mtime doubles as
+the LRU clock: hits touch the file, and the oldest files are evicted once the
+cache grows past TTS_CACHE_MAX_MB.
+"""
+import os
+import sys
+import json
+import hashlib
+import tempfile
+import numpy as np
+
+# Config
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", "/app/output/.cache/tts")
+CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "1") == "1"
+CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_MB", "2048")) * 1024 * 1024
+
+# Counters for the current run
+_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+_cache_size = None  # Bytes on disk, computed lazily
+
+def normalize_text(text):
+    """Collapse whitespace so formatting-only changes still hit the cache"""
+    return " ".join(text.split())
+
+def cache_key(text, voice, lang_code, sample_rate, model_version):
+    """Hash of everything that changes the synthesized audio"""
+    payload = json.dumps([normalize_text(text), voice, lang_code, sample_rate, model_version])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def _cache_path(key):
+    return os.path.join(CACHE_DIR, key[:2], f"{key}.f32")
+
+def _list_cache_files():
+    """All cached files as (mtime, size, path)"""
+    entries = []
+    if not os.path.exists(CACHE_DIR):
+        return entries
+    for root, _, files in os.walk(CACHE_DIR):
+        for name in files:
+            if name.endswith(".tmp"):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+def load_cached_audio(key):
+    """Return cached audio array for key, or None on a miss"""
+    if not CACHE_ENABLED:
+        return None
+    path = _cache_path(key)
+    try:
+        audio = np.memmap(path, dtype="<f4", mode="r")
+        os.utime(path)  # LRU: đánh dấu vừa dùng
+    except (OSError, ValueError):
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    return audio
+
+class CacheWriter:
+    """Write one cache entry incrementally; it only becomes visible on commit()"""
+
+    def __init__(self, key):
+        self.key = key
+        self.path = _cache_path(key)
+        self.file = None
+        self.temp_path = None
+        if not CACHE_ENABLED:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Ghi file tạm rồi rename để các process song song không đọc file dở
+            fd, self.temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            self.file = os.fdopen(fd, "wb")
+        except OSError as e:
+            print(f"⚠️ Cannot open TTS cache entry: {e}")
+
+    def write(self, audio):
+        if self.file is not None:
+            self.file.write(np.asarray(audio, dtype="<f4").tobytes())
+
+    def commit(self):
+        """Publish the entry, then evict least recently used files if over the limit"""
+        global _cache_size
+        if self.file is None:
+            return
+        try:
+            self.file.close()
+            self.file = None
+            os.replace(self.temp_path, self.path)
+            self.temp_path = None
+        except OSError as e:
+            print(f"⚠️ Cannot store TTS cache entry: {e}")
+            return
+
+        _stats["stores"] += 1
+        if _cache_size is None:
+            _cache_size = sum(size for _, size, _ in _list_cache_files())
+        else:
+            _cache_size += os.path.getsize(self.path)
+
+        if _cache_size > CACHE_MAX_BYTES:
+            evict_to_limit()
+
+    def discard(self):
+        """Drop an uncommitted entry (no-op after commit)"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.temp_path and os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.temp_path = None
+
+def store_cached_audio(key, audio):
+    """Save a complete audio array under key"""
+    writer = CacheWriter(key)
+    writer.write(audio)
+    writer.commit()
+    writer.discard()
+
+def evict_to_limit(max_bytes=CACHE_MAX_BYTES):
+    """Remove least recently used entries until the cache fits in max_bytes"""
+    global _cache_size
+    entries = sorted(_list_cache_files())
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        _stats["evictions"] += 1
+    _cache_size = total
+
+def record_stats(hits, misses):
+    """Merge counters reported by another process (parallel TTS workers)"""
+    _stats["hits"] += hits
+    _stats["misses"] += misses
+
+def get_stats():
+    return dict(_stats)
+
+def reset_stats():
+    for name in _stats:
+        _stats[name] = 0
+
+def print_stats():
+    """Print hit/miss counters for the current run"""
+    if not CACHE_ENABLED:
+        return
+    lookups = _stats["hits"] + _stats["misses"]
+    hit_rate = _stats["hits"] / lookups * 100 if lookups else 0.0
+    print(f"💾 TTS cache: {_stats['hits']} hits, {_stats['misses']} misses "
+          f"({hit_rate:.1f}% hit rate), {_stats['evictions']} evicted")
+
+def main():
+    """Main function: print cache size, `--clear` empties it"""
+    if "--clear" in sys.argv[1:]:
+        evict_to_limit(0)
+        print(f"🧹 Cleared TTS cache: {CACHE_DIR}")
+        return True
+
+    entries = _list_cache_files()
+    total = sum(size for _, size, _ in entries)
+    print(f"💾 TTS cache {CACHE_DIR}: {len(entries)} segments, "
+          f"{total / (1024 * 1024):.1f}/{CACHE_MAX_BYTES / (1024 * 1024):.0f} MB")
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
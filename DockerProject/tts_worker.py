@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""Long-lived Kokoro TTS worker.
+
+Loads the Kokoro pipeline and voice once, then serves synthesis jobs over a
+local TCP socket (one JSON object per line) so every video does not pay the
+torch import + KPipeline cold start again.
+"""
+import os
+import sys
+import json
+import time
+import queue
+import socket
+import socketserver
+import struct
+import subprocess
+import threading
+
+# Config
+WORKER_HOST = os.getenv("TTS_WORKER_HOST", "127.0.0.1")
+WORKER_PORT = int(os.getenv("TTS_WORKER_PORT", "50771"))
+WORKER_ENABLED = os.getenv("TTS_WORKER_ENABLED", "1") == "1"
+STARTUP_TIMEOUT = int(os.getenv("TTS_WORKER_STARTUP_TIMEOUT", "300"))
+REQUEST_TIMEOUT = int(os.getenv("TTS_WORKER_TIMEOUT", "1800"))
+ERROR_FRAME = 0xFFFFFFFF  # Length sentinel: a length-prefixed UTF-8 error message follows
+
+# Worker state (server side)
+_state = {
+    "status": "loading",
+    "kokoro": False,
+    "load_seconds": None,
+    "jobs_done": 0,
+    "prefetched": 0,
+    "started_at": time.time(),
+}
+_pipeline = None
+_stream_pipeline = None
+_job_lock = threading.Lock()
+_prefetch_queue = queue.Queue()
+
+def _send_request(payload, timeout=5):
+    """Send one JSON request to the worker and return the JSON response"""
+    with socket.create_connection((WORKER_HOST, WORKER_PORT), timeout=timeout) as sock:
+        sock.sendall((json.dumps(payload) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as reader:
+            line = reader.readline()
+    if not line:
+        raise ConnectionError("Empty response from TTS worker")
+    return json.loads(line)
+
+def health_check(timeout=2):
+    """Return worker health dict, or None if the worker is not reachable"""
+    try:
+        return _send_request({"cmd": "health"}, timeout=timeout)
+    except (OSError, ValueError):
+        return None
+
+def is_worker_warm():
+    """True when the worker is up and its pipeline is loaded"""
+    health = health_check()
+    return bool(health and health.get("status") == "warm")
+
+def request_generate(lines, output_dir=None):
+    """Ask the worker to generate output_{i}.wav for every line, return success count.
+
+    output_dir should be private to this request: closing the connection (e.g.
+    on timeout) cancels the job, but lines already being synthesized may still
+    be written there.
+    """
+    response = _send_request({"cmd": "generate", "lines": lines, "output_dir": output_dir}, timeout=REQUEST_TIMEOUT)
+    if not response.get("ok"):
+        raise RuntimeError(response.get("error", "TTS worker failed"))
+    return response["success_count"]
+
+def request_prefetch(lines):
+    """Queue script lines for synthesis into the TTS cache; False if the worker is not reachable"""
+    try:
+        return bool(_send_request({"cmd": "prefetch", "lines": lines}).get("ok"))
+    except (OSError, ValueError):
+        return False
+
+def stream_line_pcm(text):
+    """Synthesize one line on the worker, return (sample_rate, raw float32 PCM chunks as they arrive).
+
+    The header is read before returning, so the caller knows the PCM format
+    before the first chunk; the connection stays open until the chunks are consumed.
+    """
+    sock = socket.create_connection((WORKER_HOST, WORKER_PORT), timeout=REQUEST_TIMEOUT)
+    try:
+        sock.sendall((json.dumps({"cmd": "stream_line", "text": text}) + "\n").encode("utf-8"))
+        reader = sock.makefile("rb")
+        header = json.loads(reader.readline() or b"{}")
+        if not header.get("ok"):
+            raise RuntimeError(header.get("error", "TTS worker failed"))
+    except BaseException:
+        sock.close()
+        raise
+    return header["sample_rate"], _iter_pcm_frames(sock, reader)
+
+def _iter_pcm_frames(sock, reader):
+    # Frames: 4-byte length + PCM bytes, length 0 = end of line, ERROR_FRAME = failed
+    with sock, reader:
+        while True:
+            size = _read_frame_size(reader)
+            if size == 0:
+                return
+            if size == ERROR_FRAME:
+                message = reader.read(_read_frame_size(reader)).decode("utf-8", "replace")
+                raise RuntimeError(f"TTS worker failed mid-stream: {message}")
+            yield reader.read(size)
+
+def _read_frame_size(reader):
+    size_bytes = reader.read(4)
+    if len(size_bytes) < 4:
+        raise ConnectionError("TTS worker closed the stream early")
+    return struct.unpack("!I", size_bytes)[0]
+
+def wait_until_warm(timeout=STARTUP_TIMEOUT, proc=None):
+    """Poll the health check until the worker reports warm"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc is not None and proc.poll() is not None:
+            return False
+        health = health_check()
+        if health and health.get("status") == "warm":
+            return True
+        if health and health.get("status") == "error":
+            return False
+        time.sleep(0.5)
+    return False
+
+def start_worker():
+    """Start the worker in the background if it is not already running.
+
+    Returns the Popen handle of the started process, or None when a worker was
+    already running, the worker is disabled, or it failed to get warm.
+    """
+    if not WORKER_ENABLED:
+        return None
+
+    if is_worker_warm():
+        print("✅ TTS worker already running")
+        return None
+
+    print("🚀 Starting TTS worker...")
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_worker.py")
+    proc = subprocess.Popen([sys.executable, script])
+
+    start = time.time()
+    if wait_until_warm(proc=proc):
+        print(f"✅ TTS worker warm after {time.time() - start:.1f}s")
+        return proc
+
+    print("⚠️ TTS worker did not become warm, falling back to in-process TTS")
+    stop_worker(proc)
+    return None
+
+def stop_worker(proc):
+    """Stop a worker process started by start_worker"""
+    if proc is None or proc.poll() is not None:
+        return
+    try:
+        _send_request({"cmd": "shutdown"})
+    except (OSError, ValueError):
+        pass
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    print("🛑 TTS worker stopped")
+
+class WorkerHandler(socketserver.StreamRequestHandler):
+    """Handle one JSON request per connection"""
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line)
+            if request.get("cmd") == "stream_line":
+                # stream_line không để lỗi thoát ra sau header (báo bằng ERROR_FRAME)
+                self.stream_line(request)
+                return
+            response = self.dispatch(request)
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+    def dispatch(self, request):
+        cmd = request.get("cmd")
+
+        if cmd == "health":
+            return {"ok": True, "uptime": time.time() - _state["started_at"], **_state}
+
+        if cmd == "generate":
+            if _state["status"] != "warm":
+                return {"ok": False, "error": f"worker is {_state['status']}"}
+            import audio_generator
+            cancelled = self.watch_disconnect()
+            # One job at a time - health checks still answer while busy
+            with _job_lock:
+                if cancelled.is_set():
+                    return {"ok": False, "error": "client disconnected"}
+                success_count = audio_generator.generate_audio_for_lines(
+                    request["lines"], _pipeline, request.get("output_dir"), cancelled
+                )
+                _state["jobs_done"] += 1
+            return {"ok": True, "success_count": success_count}
+
+        if cmd == "prefetch":
+            if _state["status"] != "warm":
+                return {"ok": False, "error": f"worker is {_state['status']}"}
+            # Trả lời ngay, synth chạy nền để không chặn LLM stream
+            for line in request["lines"]:
+                _prefetch_queue.put(line)
+            return {"ok": True, "queued": _prefetch_queue.qsize()}
+
+        if cmd == "shutdown":
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return {"ok": True}
+
+        return {"ok": False, "error": f"unknown command: {cmd}"}
+
+    def watch_disconnect(self):
+        """Event set when the client closes the connection (it sends nothing after the request line)"""
+        cancelled = threading.Event()
+
+        def watch():
+            try:
+                self.connection.recv(1)
+            except OSError:
+                pass
+            cancelled.set()
+
+        threading.Thread(target=watch, daemon=True).start()
+        return cancelled
+
+    def stream_line(self, request):
+        """Write a JSON header, then one PCM frame per synthesized segment.
+
+        Once the header is out the connection carries only frames: a failure
+        ends the stream with an ERROR_FRAME instead of a JSON line.
+        """
+        if _state["status"] != "warm":
+            self.wfile.write((json.dumps({"ok": False, "error": f"worker is {_state['status']}"}) + "\n").encode("utf-8"))
+            return
+        import audio_generator
+        header = {"ok": True, "sample_rate": audio_generator.SAMPLE_RATE, "format": "f32le", "channels": 1}
+        try:
+            self.wfile.write((json.dumps(header) + "\n").encode("utf-8"))
+            with _job_lock:
+                for audio in audio_generator.iter_line_audio(request["text"], get_stream_pipeline()):
+                    data = audio.astype("<f4", copy=False).tobytes()
+                    self.wfile.write(struct.pack("!I", len(data)) + data)
+            self.wfile.write(struct.pack("!I", 0))
+        except OSError:
+            # Client đã ngắt kết nối, không còn ai để báo lỗi
+            print("⚠️ Stream client disconnected")
+        except Exception as e:
+            print(f"❌ Stream failed: {e}")
+            message = str(e).encode("utf-8")
+            try:
+                self.wfile.write(struct.pack("!II", ERROR_FRAME, len(message)) + message)
+            except OSError:
+                pass
+
+class WorkerServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+def load_worker_pipeline():
+    """Load Kokoro pipeline and voice once, then mark the worker warm"""
+    global _pipeline
+    start = time.time()
+    try:
+        import audio_generator
+        _pipeline = audio_generator.prepare_tts()
+        _state["kokoro"] = audio_generator.KOKORO_AVAILABLE
+        _state["mode"] = audio_generator.TTS_MODE
+        _state["load_seconds"] = time.time() - start
+        _state["status"] = "warm"
+        print(f"✅ TTS worker warm ({_state['load_seconds']:.1f}s, kokoro={_state['kokoro']})")
+    except Exception as e:
+        _state["status"] = "error"
+        print(f"❌ TTS worker failed to load pipeline: {e}")
+
+def prefetch_loop():
+    """Synthesize queued lines so their segments are in the TTS cache before the video step"""
+    import audio_generator
+    while True:
+        line = _prefetch_queue.get()
+        try:
+            with _job_lock:
+                for _ in audio_generator.iter_line_audio(line, get_stream_pipeline()):
+                    pass
+            _state["prefetched"] += 1
+        except Exception as e:
+            print(f"⚠️ Prefetch failed: {e}")
+
+def get_stream_pipeline():
+    """Pipeline for streaming jobs (parallel mode keeps its pipelines in the pool)"""
+    global _stream_pipeline
+    if _pipeline is not None:
+        return _pipeline
+    if _stream_pipeline is None:
+        import audio_generator
+        _stream_pipeline = audio_generator.load_pipeline()
+    return _stream_pipeline
+
+def serve():
+    """Run the worker until a shutdown request arrives"""
+    with WorkerServer((WORKER_HOST, WORKER_PORT), WorkerHandler) as server:
+        print(f"🎧 TTS worker listening on {WORKER_HOST}:{WORKER_PORT}")
+        # Listen right away so health checks can report "loading"
+        threading.Thread(target=load_worker_pipeline, daemon=True).start()
+        threading.Thread(target=prefetch_loop, daemon=True).start()
+        server.serve_forever()
+
+def main():
+    """Main function: `--health` prints worker status, otherwise serve"""
+    if "--health" in sys.argv[1:]:
+        health = health_check()
+        print(json.dumps(health, indent=2) if health else "❌ TTS worker not reachable")
+        return bool(health and health.get("status") == "warm")
+
+    serve()
+    return True
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
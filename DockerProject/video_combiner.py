@@ -5,15 +5,27 @@ import subprocess
 import sys
 from PIL import Image
 
+import tts_worker
+
 # Paths
 IMAGES_DIR = "/app/temp/my_images"
 AUDIO_DIR = "/app/temp/my_audio"
 OUTPUT_VIDEO = "/app/temp/final_video.mp4"
+SCRIPT_FILE = "/app/temp/current_script.txt"
 
 # Video settings
 TARGET_WIDTH = 1280
 TARGET_HEIGHT = 720
 
+# Audio streaming: TTS → raw PCM → ffmpeg stdin, không ghi WAV trung gian
+STREAM_AUDIO = os.getenv("TTS_OUTPUT", "file") == "stream"
+
+# Line audio written by audio_generator (AUDIO_FORMAT)
+AUDIO_EXTENSIONS = ('.wav', '.flac')
+
+# Local pipeline when streaming without a TTS worker
+_local_pipeline = None
+
 def extract_number(filename):
     """Extract number from filename for sorting"""
     match = re.search(r"(\d+)", filename)
@@ -91,7 +103,7 @@ def create_video_from_images_and_audio():
         key=extract_number
     )
     audio_files = sorted(
-        [f for f in os.listdir(AUDIO_DIR) if f.lower().endswith('.wav')],
+        [f for f in os.listdir(AUDIO_DIR) if f.lower().endswith(AUDIO_EXTENSIONS)],
         key=extract_number
     )
 
@@ -154,6 +166,10 @@ def create_video_from_images_and_audio():
             if os.path.exists(processed_img):
                 os.remove(processed_img)
 
+    return combine_clips(video_clips)
+
+def combine_clips(video_clips):
+    """Rename a single clip or concatenate several into OUTPUT_VIDEO"""
     if not video_clips:
         print("❌ No video clips were created!")
         return False
@@ -205,11 +221,127 @@ def create_video_from_images_and_audio():
     
     return False
 
+def iter_line_pcm(text):
+    """(sample_rate, raw float32 PCM chunks) for one script line, from the warm TTS worker or a local pipeline"""
+    global _local_pipeline
+    if tts_worker.is_worker_warm():
+        return tts_worker.stream_line_pcm(text)
+    
+    import audio_generator
+    if _local_pipeline is None:
+        _local_pipeline = audio_generator.load_pipeline()
+    chunks = (audio.astype("<f4", copy=False).tobytes()
+              for audio in audio_generator.iter_line_audio(text, _local_pipeline))
+    return audio_generator.SAMPLE_RATE, chunks
+
+def create_clip_from_pcm_stream(img_path, sample_rate, pcm_chunks, clip_output):
+    """Pipe mono float32 PCM chunks at sample_rate into ffmpeg as they are synthesized, return audio duration"""
+    clip_cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-loop", "1", "-i", img_path,
+        "-f", "f32le", "-ar", str(sample_rate), "-ac", "1", "-i", "pipe:0",
+        "-c:v", "libx264",
+        "-preset", "medium",
+        "-crf", "23",
+        "-c:a", "aac",
+        "-b:a", "192k",
+        "-shortest",
+        "-pix_fmt", "yuv420p",
+        "-r", "30",
+        clip_output
+    ]
+    
+    process = subprocess.Popen(clip_cmd, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    total_bytes = 0
+    finished = False
+    try:
+        try:
+            for chunk in pcm_chunks:
+                process.stdin.write(chunk)
+                total_bytes += len(chunk)
+        except BrokenPipeError:
+            pass  # ffmpeg exited early, error is reported below
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+        
+        stderr = process.stderr.read().decode(errors="replace")
+        process.wait()
+        if process.returncode != 0 or total_bytes == 0:
+            raise subprocess.CalledProcessError(process.returncode, clip_cmd, stderr=stderr or "no audio data")
+        finished = True
+    finally:
+        if not finished:
+            # TTS lỗi giữa chừng hoặc ffmpeg lỗi: không để lại process, kết nối TTS hay clip dở dang
+            pcm_chunks.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            process.stderr.close()
+            if os.path.exists(clip_output):
+                os.remove(clip_output)
+    
+    return total_bytes / 4 / sample_rate
+
+def create_video_streaming():
+    """Streaming mode: synthesize each line straight into the ffmpeg clip encoder"""
+    print("🎬 Creating video with streamed audio (no intermediate WAV files)...")
+    
+    if not os.path.exists(IMAGES_DIR) or not os.path.exists(SCRIPT_FILE):
+        print(f"❌ Missing inputs - Images: {os.path.exists(IMAGES_DIR)}, Script: {os.path.exists(SCRIPT_FILE)}")
+        return False
+    
+    with open(SCRIPT_FILE, "r", encoding="utf-8") as file:
+        lines = [line.strip() for line in file.readlines() if line.strip()]
+    image_files = sorted(
+        [f for f in os.listdir(IMAGES_DIR) if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
+        key=extract_number
+    )
+    
+    print(f"📊 Found {len(image_files)} images and {len(lines)} script lines")
+    
+    min_files = min(len(image_files), len(lines))
+    if min_files == 0:
+        print("❌ Missing images or script lines!")
+        return False
+    if len(image_files) != len(lines):
+        print(f"⚠️ Count mismatch - using first {min_files} from each")
+    
+    video_clips = []
+    for i, (img_file, line_text) in enumerate(zip(image_files[:min_files], lines[:min_files])):
+        img_path = os.path.join(IMAGES_DIR, img_file)
+        print(f"🔄 Processing clip {i+1}/{min_files}: {img_file} + line {i+1} ({len(line_text)} chars)")
+        
+        processed_img = resize_image(img_path, TARGET_WIDTH, TARGET_HEIGHT)
+        clip_output = f"/app/temp/clip_{i}.mp4"
+        
+        try:
+            sample_rate, pcm_chunks = iter_line_pcm(line_text)
+            duration = create_clip_from_pcm_stream(processed_img, sample_rate, pcm_chunks, clip_output)
+            video_clips.append(clip_output)
+            print(f"✅ Created clip {i+1}: {clip_output} ({duration:.2f}s audio)")
+        except Exception as e:
+            print(f"❌ Error creating clip {i+1}: {e}")
+            if getattr(e, "stderr", None):
+                print(f"FFmpeg error: {e.stderr}")
+            continue
+        finally:
+            # Clean up temporary image
+            if os.path.exists(processed_img):
+                os.remove(processed_img)
+    
+    return combine_clips(video_clips)
+
 def main():
     """Main function"""
     print("🎬 Combining audio and images into video...")
     
-    success = create_video_from_images_and_audio()
+    if STREAM_AUDIO:
+        success = create_video_streaming()
+    else:
+        success = create_video_from_images_and_audio()
     
     if success:
         print("✅ Video combination completed!")